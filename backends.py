@@ -0,0 +1,88 @@
+from constants import backend as default_backend
+import os
+import traci
+
+
+class LibsumoBackend:
+    """
+    Runs sumo inside this process through libsumo. The fastest option, but it holds a single simulation per process
+    and cannot drive sumo-gui.
+    """
+    name = 'libsumo'
+    in_use = False
+
+    def start(self, sumo_cmd):
+        import libsumo
+
+        if LibsumoBackend.in_use:
+            raise ValueError("libsumo runs a single simulation per process, use traci to run several.")
+        if 'gui' in os.path.basename(sumo_cmd[0]):
+            raise ValueError("libsumo cannot drive {0}, use traci.".format(sumo_cmd[0]))
+
+        libsumo.start(sumo_cmd)
+        LibsumoBackend.in_use = True
+        return libsumo
+
+    def close(self, conn):
+        conn.close()
+        LibsumoBackend.in_use = False
+
+
+class TraciBackend:
+    """
+    Runs sumo (or sumo-gui) as its own process and talks to it over a traci socket. Without a label it uses traci's
+    default connection, with one a process can hold as many connections as it has labels.
+    """
+    name = 'traci'
+
+    def __init__(self, label=None):
+        self.label = label
+
+    def start(self, sumo_cmd):
+        if self.label is None:
+            traci.start(sumo_cmd)
+            return traci
+
+        traci.start(sumo_cmd, label=self.label)
+        return traci.getConnection(self.label)
+
+    def close(self, conn):
+        conn.close()
+
+
+def libsumo_available():
+    try:
+        import libsumo
+    except ImportError:
+        return False
+    return True
+
+
+def fastest():
+    return 'libsumo' if libsumo_available() else 'traci'
+
+
+def available():
+    return ['libsumo', 'traci'] if libsumo_available() else ['traci']
+
+
+def get_backend(name=None, label=None):
+    """
+    Returns a backend by name: 'libsumo', 'traci', or 'fastest' for libsumo when it is installed. None picks the
+    backend set in constants. A label asks for a labelled traci connection. Backend objects are passed through.
+    """
+    if hasattr(name, 'start'):
+        return name
+    if name is None:
+        name = default_backend
+    if name == 'fastest':
+        name = fastest()
+
+    if name == 'libsumo':
+        if label is not None:
+            raise ValueError("libsumo runs a single simulation per process, labelled connections need traci.")
+        return LibsumoBackend()
+    elif name == 'traci':
+        return TraciBackend(label)
+
+    raise ValueError("Unknown sumo backend {0}, expected libsumo, traci or fastest.".format(name))
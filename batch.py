@@ -0,0 +1,86 @@
+from constants import sumoCmd, t_step, total_steps
+from compiled_ctrnn import BatchCTRNN
+from concurrent.futures import ThreadPoolExecutor
+from evaluation import Evaluator
+import os
+
+
+class BatchEvaluator:
+    """
+    Drives several sumo instances from one process over labelled traci connections. The simulations are stepped in
+    lockstep on a thread each, so their socket waits overlap, and all of the nets advance together in one BatchCTRNN.
+    """
+
+    def __init__(self, size, sumo_cmd=sumoCmd, runtime=total_steps):
+        self.size = size
+        self.runtime = runtime
+        self.evaluators = [Evaluator.create(sumo_cmd=sumo_cmd, runtime=runtime,
+                                            label='batch-{0}-{1}'.format(os.getpid(), i)) for i in range(size)]
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.truncated = []
+
+    def __del__(self):
+        self.executor.shutdown()
+
+    def get_fitnesses(self, nets, cmds, cutoffs=None, runtimes=None):
+        """
+        Scores up to size compiled nets, each on its own command. A net of None runs the baseline controller. Net runs
+        can be given cutoffs, as in Evaluator.get_net_fitness, and self.truncated flags the runs that were stopped.
+        runtimes sets the steps simulated by each run, by default the runtime the engine was made with.
+        """
+        if cutoffs is None:
+            cutoffs = [None for _ in nets]
+        if runtimes is None:
+            runtimes = [self.runtime for _ in nets]
+
+        if len(nets) > self.size:
+            raise ValueError("Batch of {0} runs exceeds the {1} simulations available.".format(len(nets), self.size))
+
+        evaluators = self.evaluators[:len(nets)]
+        for ev, runtime in zip(evaluators, runtimes):
+            ev.runtime = runtime
+        list(self.executor.map(lambda pair: pair[0].reset(cmd=pair[1]), zip(evaluators, cmds)))
+
+        controlled = [i for i, net in enumerate(nets) if net is not None]
+        batch_net = BatchCTRNN([nets[i] for i in controlled]) if controlled else None
+
+        steps = [ev.start_step for ev in evaluators]
+        periods = [0 for _ in evaluators]  # steps each simulation advanced in the last pass
+        running = [True for _ in evaluators]
+        decisions = [None for _ in evaluators]
+        self.truncated = [False for _ in evaluators]
+        bounds = [None for _ in evaluators]
+
+        def step(i):  # apply the last decision, then advance the simulation like one pass of get_net_fitness
+            ev = evaluators[i]
+            if decisions[i] is not None:
+                ev.apply_outputs(decisions[i])
+
+            periods[i] = 0
+            if steps[i] >= ev.runtime or (steps[i] > ev.start_step and ev.min_expected == 0):
+                running[i] = False
+                return
+
+            periods[i] = min(ev.control_period, ev.runtime - steps[i])
+            ev.do_timestep(periods[i])
+            steps[i] += periods[i]
+
+            if cutoffs[i] is not None and nets[i] is not None:
+                bound = ev.get_score_bound()
+                if bound is not None and bound < cutoffs[i] and ev.min_expected != 0:
+                    self.truncated[i] = True
+                    bounds[i] = bound
+                    running[i] = False
+
+        while True:
+            list(self.executor.map(step, [i for i in range(len(evaluators)) if running[i]]))
+            if not any(running):
+                break
+
+            if batch_net is not None:  # each net advances by the period its own simulation just ran, finished ones not
+                outputs = batch_net.advance([evaluators[i].get_inputs() for i in controlled],
+                                            [periods[i] * t_step for i in controlled], t_step)
+                for row, i in enumerate(controlled):
+                    decisions[i] = outputs[row].tolist() if running[i] else None
+
+        return [bounds[i] if self.truncated[i] else ev.get_score() for i, ev in enumerate(evaluators)]
@@ -0,0 +1,331 @@
+from constants import sumoCmd, t_step, total_steps, batch_size
+from compiled_ctrnn import CompiledCTRNN
+import backends
+import evaluation
+import workers
+import neat
+import gzip
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import random
+import statistics
+import subprocess
+import time
+import timeit
+import traceback
+
+# scenarios the evaluator benchmark runs on. Grid has no saved winner, so the fittest genome of its last checkpoint
+# stands in, and the cross genome predates the two outputs per light the evaluator expects, so only its baseline runs.
+scenarios = {
+    'cbd': {'sumocfg': 'sumo/cbd/tinycbd.sumocfg', 'config': 'neat/config-ctrnn-cbd',
+            'genome': 'neat/cbd/winner-genome-8_2'},
+    'grid': {'sumocfg': 'sumo/grid/grid.sumocfg', 'config': 'neat/config-ctrnn-grid',
+             'checkpoint': 'neat/grid/checkpoints/neat-checkpoint-99'},
+    'cross': {'sumocfg': 'sumo/cross/cross.sumocfg', 'checkpoint': 'neat/cross/neat-checkpoint-239',
+              'genome': 'neat/cross/winner-genome'},
+}
+
+
+def benchmark_compiled_net(config_file, w_path, steps=total_steps, repeat=5):
+    """
+    Times one run's worth of CTRNN steps for neat-python's CTRNN and the compiled version of the same genome.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    rng = random.Random(0)
+    inputs = [[rng.random() * 100 for _ in range(config.genome_config.num_inputs)] for _ in range(steps)]
+
+    results = {}
+    for name, create in (('neat', neat.ctrnn.CTRNN.create), ('compiled', CompiledCTRNN.create)):
+        net = create(genome, config, t_step)
+
+        def run():
+            net.reset()
+            for x in inputs:
+                net.advance(x, t_step, t_step)
+
+        results[name] = min(timeit.repeat(run, number=1, repeat=repeat)) / steps
+
+    for name, seconds in results.items():
+        print("{0:>10}: {1:.2f} us per step".format(name, seconds * 1e6))
+    print("   speedup: {0:.1f}x".format(results['neat'] / results['compiled']))
+
+    return results
+
+
+def benchmark_control_period(config_file, w_path, periods=(1, 2, 5, 10, 20, 40), seeds=range(5)):
+    """
+    Runs the baseline and a stored genome at several control periods and reports the mean score and wall time per
+    run for each, so the cost of querying the net less often can be weighed against the time saved.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    ev = evaluation.Evaluator(sumo_cmd=sumoCmd, runtime=total_steps)
+    net = CompiledCTRNN.create(genome, config, t_step)
+
+    results = []
+    for period in periods:
+        ev.control_period = period
+        for name in ('baseline', 'net'):
+            scores = []
+            start = time.perf_counter()
+            for seed in seeds:
+                cmd = sumoCmd + ['--seed', str(seed)]
+                scores.append(ev.run_baseline(cmd=cmd) if name == 'baseline' else ev.get_net_fitness(net, cmd=cmd))
+            seconds = (time.perf_counter() - start) / len(seeds)
+
+            results.append({'period': period, 'controller': name, 'mean_score': statistics.mean(scores),
+                            'seconds_per_run': seconds})
+            print("period {0:>3} ({1:>4.1f}s) {2:>8}: mean score {3:8.3f}, {4:.3f}s per run"
+                  .format(period, period * t_step, name, statistics.mean(scores), seconds))
+
+    return results
+
+
+def load_scenario(name):
+    """
+    Returns the sumo command, neat config and stored genome of one of the benchmark scenarios.
+    """
+    spec = scenarios[name]
+    cmd = ['sumo', '-c', spec['sumocfg'], '--step-length', str(t_step)]
+
+    if 'checkpoint' in spec:
+        with gzip.open(spec['checkpoint']) as f:
+            _, config, population, _, _ = pickle.load(f)
+
+    if 'config' in spec:
+        config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                             neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                             spec['config'])
+
+    if 'genome' in spec:
+        with open(spec['genome'], 'rb') as f:
+            genome = pickle.load(f)
+    else:
+        genome = max(population.values(), key=lambda g: g.fitness if g.fitness is not None else float('-inf'))
+
+    return cmd, config, genome
+
+
+def get_controllers(config, ev):
+    """
+    The baseline always runs, the stored genome only if its inputs and outputs fit the scenario.
+    """
+    genome_config = config.genome_config
+    if genome_config.num_inputs == ev.num_loops and genome_config.num_outputs == 2 * len(ev.tlight_IDs):
+        return ['baseline', 'net']
+    return ['baseline']
+
+
+def _isolated_main(target, args, results):
+    try:
+        results.put((target(*args), None))
+    except Exception:
+        results.put((None, traceback.format_exc()))
+
+
+def run_isolated(target, *args):
+    """
+    Calls target(*args) in a new process and returns its result, so that every measurement starts from a process
+    with no simulation running (libsumo holds one per process) and no pool workers left over.
+    """
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_isolated_main, args=(target, args, results))
+    proc.start()
+    result, error = results.get()
+    proc.join()
+
+    if error is not None:
+        raise RuntimeError("Benchmark {0}{1} failed:\n{2}".format(target.__name__, args[:1], error))
+    return result
+
+
+def benchmark_serial(name, seeds, backend, runtime=total_steps):
+    """
+    Times each controller on each seed with a single Evaluator, as in eval_genomes. Returns one row per run.
+    """
+    cmd, config, genome = load_scenario(name)
+    ev = evaluation.Evaluator(sumo_cmd=cmd, runtime=runtime, backend=backend)
+    net = CompiledCTRNN.create(genome, config, t_step)
+
+    rows = []
+    for controller in get_controllers(config, ev):
+        for seed in seeds:
+            run_cmd = cmd + ['--seed', str(seed)]
+            start = time.perf_counter()
+            if controller == 'baseline':
+                score = ev.run_baseline(cmd=run_cmd)
+            else:
+                score = ev.get_net_fitness(net, cmd=run_cmd)
+            seconds = time.perf_counter() - start
+
+            rows.append({'scenario': name, 'backend': backend, 'controller': controller, 'mode': 'serial',
+                         'workers': 1, 'seed': seed, 'runs': 1, 'score': score, 'wall_seconds': seconds,
+                         'sim_seconds': ev.conn.simulation.getTime() - ev.start_step * t_step})
+
+    return rows
+
+
+def benchmark_pool(name, seeds, num, sim_seconds, backend, jobs_per_worker=4, runtime=total_steps):
+    """
+    Times batches of jobs_per_worker runs per worker through an EvaluationPool of num workers, with the cache off.
+    sim_seconds maps (controller, seed) to the simulated time of that run, as measured by benchmark_serial.
+    """
+    cmd, config, genome = load_scenario(name)
+    controllers = sorted(set(controller for controller, _ in sim_seconds))
+    pool = workers.EvaluationPool(num=num, sumo_cmd=cmd, runtime=runtime, cached=False, backend=backend,
+                                  size=1 if backend == 'libsumo' else batch_size)
+
+    pool.evaluate([(None, seeds[0]) for _ in range(num)])  # wait for every worker to have sumo up
+
+    rows = []
+    for controller in controllers:
+        jobs = [(genome if controller == 'net' else None, seeds[i % len(seeds)]) for i in range(num * jobs_per_worker)]
+        start = time.perf_counter()
+        pool.evaluate(jobs, config=config)
+        seconds = time.perf_counter() - start
+
+        rows.append({'scenario': name, 'backend': backend, 'controller': controller, 'mode': 'pool',
+                     'workers': num, 'seed': None, 'runs': len(jobs), 'score': None, 'wall_seconds': seconds,
+                     'sim_seconds': sum(sim_seconds[(controller, seed)] for _, seed in jobs)})
+
+    pool.close()
+    return rows
+
+
+def summarise(rows, runs_per_net=25):
+    """
+    Reduces benchmark rows to one entry per scenario, backend, controller, mode and worker count, with throughput in
+    simulated seconds per wall second, the wall time of a generation (pop_size genomes times runs_per_net runs) at
+    that throughput, and for the pool the scaling efficiency against one pool worker.
+    """
+    groups = {}
+    for row in rows:
+        key = (row['scenario'], row['backend'], row['controller'], row['mode'], row['workers'])
+        groups.setdefault(key, []).append(row)
+
+    pop_sizes = {}
+    summary = []
+    for key, group in sorted(groups.items()):
+        scenario, backend, controller, mode, num = key
+        if scenario not in pop_sizes:
+            pop_sizes[scenario] = load_scenario(scenario)[1].pop_size
+
+        runs = sum(row['runs'] for row in group)
+        wall = sum(row['wall_seconds'] for row in group)
+        summary.append({'scenario': scenario, 'backend': backend, 'controller': controller, 'mode': mode,
+                        'workers': num, 'runs': runs,
+                        'sim_per_wall': sum(row['sim_seconds'] for row in group) / wall,
+                        'seconds_per_run': wall / runs,
+                        'seconds_per_generation': wall / runs * pop_sizes[scenario] * runs_per_net})
+
+    for entry in summary:
+        if entry['mode'] != 'pool':
+            continue
+        for single in summary:
+            if single['mode'] == 'pool' and single['workers'] == 1 and all(
+                    single[k] == entry[k] for k in ('scenario', 'backend', 'controller')):
+                entry['efficiency'] = entry['sim_per_wall'] / (entry['workers'] * single['sim_per_wall'])
+
+    return summary
+
+
+def get_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def benchmark_evaluator(names=('cbd', 'grid', 'cross'), backend_names=None, worker_counts=None,
+                        seeds=range(3), jobs_per_worker=4, runs_per_net=25, output_dir='data/benchmarks'):
+    """
+    Measures evaluator throughput for the baseline and a stored genome on each scenario and backend, first serially
+    and then through pools of each worker count. Prints a summary and writes the rows and summary to a json file in
+    output_dir named after the commit, for compare_benchmarks.
+    """
+    if backend_names is None:
+        backend_names = backends.available()
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, multiprocessing.cpu_count()})
+    seeds = list(seeds)
+
+    rows = []
+    for backend in backend_names:
+        for name in names:
+            serial = run_isolated(benchmark_serial, name, seeds, backend)
+            rows += serial
+
+            sim_seconds = dict(((row['controller'], row['seed']), row['sim_seconds']) for row in serial)
+            for num in worker_counts:
+                rows += run_isolated(benchmark_pool, name, seeds, num, sim_seconds, backend, jobs_per_worker)
+
+    summary = summarise(rows, runs_per_net)
+
+    print("{0:>8} {1:>8} {2:>9} {3:>7} {4:>3} {5:>12} {6:>10} {7:>12} {8:>6}".format(
+        'scenario', 'backend', 'control', 'mode', 'n', 'sim s/wall s', 's/run', 's/generation', 'eff'))
+    for entry in summary:
+        print("{scenario:>8} {backend:>8} {controller:>9} {mode:>7} {workers:>3} {sim_per_wall:12.1f} "
+              "{seconds_per_run:10.3f} {seconds_per_generation:12.1f} ".format(**entry) +
+              ("{0:6.2f}".format(entry['efficiency']) if 'efficiency' in entry else "{0:>6}".format('-')))
+
+    commit = get_commit()
+    result = {'commit': commit, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'host': {'cpus': multiprocessing.cpu_count(), 'platform': platform.platform(),
+                       'python': platform.python_version()},
+              'settings': {'t_step': t_step, 'runtime_steps': total_steps, 'seeds': seeds,
+                           'jobs_per_worker': jobs_per_worker, 'runs_per_net': runs_per_net},
+              'rows': rows, 'summary': summary}
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, '{0}-{1}.json'.format(commit or 'nocommit', time.strftime('%Y%m%d-%H%M%S')))
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=1)
+    print("Saved to {0}".format(path))
+
+    return result
+
+
+def compare_benchmarks(old_path, new_path):
+    """
+    Prints the throughput ratio of every summary entry two saved benchmarks have in common, new over old.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def key(entry):
+        return entry['scenario'], entry['backend'], entry['controller'], entry['mode'], entry['workers']
+
+    before = dict((key(entry), entry) for entry in old['summary'])
+    print("{0} -> {1}".format(old['commit'], new['commit']))
+    for entry in new['summary']:
+        if key(entry) in before:
+            print("{0:>8} {1:>8} {2:>9} {3:>7} {4:>3}: {5:.2f}x".format(
+                *key(entry), entry['sim_per_wall'] / before[key(entry)]['sim_per_wall']))
+
+
+if __name__ == '__main__':
+    local_dir = os.path.dirname(__file__)
+    config_path = os.path.join(local_dir, 'neat/config-ctrnn-cbd')
+
+    benchmark_compiled_net(config_path, os.path.join(local_dir, 'neat/cbd/winner-genome-8_2'))
+    benchmark_control_period(config_path, os.path.join(local_dir, 'neat/cbd/winner-genome-8_2'))
+    benchmark_evaluator()
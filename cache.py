@@ -0,0 +1,139 @@
+from constants import sumoCmd, total_steps, cache_path, cache_max_entries, use_generated_demand, demand_weights
+import constants
+import hashlib
+import os
+import sqlite3
+import time
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
+local_dir = os.path.dirname(os.path.abspath(__file__))
+
+# settings in constants.py that cannot change the outcome of a run, all the others are part of the scenario
+# fingerprint, so a new setting counts unless it is added here (sumoCmd and the runtime are hashed as given for the job)
+unhashed_settings = {'sumoCmd', 'runtime', 'total_steps', 'use_cache', 'cache_path', 'cache_max_entries',
+                     'use_racing', 'racing_initial_seeds', 'racing_z', 'cutoff_percentile', 'verify_phases',
+                     'coordinator_address', 'coordinator_authkey_file', 'checkpoint_dir', 'checkpoint_full_interval',
+                     'profile_evaluator', 'topology_dir', 'compare_confidence', 'compare_initial_seeds',
+                     'compare_max_seeds', 'use_screening', 'screen_fraction', 'screen_seeds', 'screen_time',
+                     'screen_audit', 'use_islands', 'islands', 'migration_interval', 'migration_size', 'trace_dir',
+                     'backend', 'worker_backend', 'batch_size'}
+
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def scenario_fingerprint(sumo_cmd, runtime=total_steps):
+    """
+    Hashes everything that decides the outcome of a run apart from the controller and the seed: the sumo command,
+    the sumocfg and every input file it names, the steps simulated, the settings in constants.py but those in
+    unhashed_settings and the code of the evaluator and the modules it runs. With generated demand the weight files
+    count too.
+    """
+    h = hashlib.sha256()
+    h.update(repr(sumo_cmd).encode())
+    h.update(repr(runtime).encode())
+    settings = sorted((name, value) for name, value in vars(constants).items()
+                      if not name.startswith('_') and name not in unhashed_settings)
+    h.update(repr(settings).encode())
+
+    for name in ('evaluation.py', 'compiled_ctrnn.py', 'timeloss.py', 'topology.py', 'backends.py'):
+        h.update(hash_file(os.path.join(local_dir, name)).encode())
+
+    config_file = sumo_cmd[sumo_cmd.index('-c') + 1]
+    h.update(hash_file(config_file).encode())
+
+    config_dir = os.path.dirname(config_file)
+    if use_generated_demand:
+        h.update(hash_file(os.path.join(local_dir, 'demand.py')).encode())
+        for suffix in ('.src.xml', '.dst.xml'):
+            path = os.path.join(config_dir, demand_weights + suffix)
+            if os.path.exists(path):
+                h.update(hash_file(path).encode())
+
+    for element in ET.parse(config_file).getroot().find('input'):
+        for name in element.get('value').split(','):
+            h.update(hash_file(os.path.join(config_dir, name.strip())).encode())
+
+    return h.hexdigest()
+
+
+def genome_fingerprint(genome):
+    """
+    Hashes the structure and parameters of a genome. Two genomes with the same fingerprint build the same net.
+    """
+    if genome is None:
+        return 'baseline'
+
+    h = hashlib.sha256()
+    for key in sorted(genome.nodes):
+        node = genome.nodes[key]
+        h.update(repr((key, node.bias, node.response, node.activation, node.aggregation)).encode())
+
+    for key in sorted(genome.connections):
+        cg = genome.connections[key]
+        h.update(repr((key, cg.weight, cg.enabled)).encode())
+
+    return h.hexdigest()
+
+
+def job_key(genome, seed, sumo_cmd=sumoCmd, runtime=total_steps):
+    return '{0}:{1}:{2}'.format(genome_fingerprint(genome), scenario_fingerprint(tuple(sumo_cmd), runtime), seed)
+
+
+class EvaluationCache:
+    """
+    An on-disk store of fitnesses keyed by genome, scenario and seed. Backed by sqlite, so any number of processes can
+    read and write it at once. Once it holds more than max_entries results the least recently used are evicted.
+    """
+
+    def __init__(self, path=cache_path, max_entries=cache_max_entries):
+        self.path = path
+        self.max_entries = max_entries
+
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')  # readers never block the writer
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS results '
+                            '(key TEXT PRIMARY KEY, fitness REAL NOT NULL, last_used REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+    def get_many(self, keys):
+        """
+        Returns a dict of the keys that are cached along with their fitness, and marks them as recently used.
+        """
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):  # stay under sqlite's limit on query parameters
+            chunk = keys[i: i + 500]
+            rows = self.db.execute('SELECT key, fitness FROM results WHERE key IN ({0})'
+                                   .format(','.join('?' * len(chunk))), chunk)
+            found.update(rows)
+
+        if found:
+            with self.db:
+                self.db.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                                    [(time.time(), key) for key in found])
+
+        return found
+
+    def put_many(self, results):
+        """
+        Stores a dict of key -> fitness, then evicts the oldest entries if the cache has grown past its bound.
+        """
+        now = time.time()
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO results (key, fitness, last_used) VALUES (?, ?, ?)',
+                                [(key, fitness, now) for key, fitness in results.items()])
+
+            count = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            if count > self.max_entries:  # trim to 90% so eviction does not run on every insert
+                self.db.execute('DELETE FROM results WHERE key IN '
+                                '(SELECT key FROM results ORDER BY last_used LIMIT ?)',
+                                (count - int(0.9 * self.max_entries),))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,249 @@
+import atexit
+import gzip
+import os
+import pickle
+import queue
+import random
+import re
+import threading
+from itertools import count
+import neat
+from neat.reporting import BaseReporter
+from neat.species import Species
+
+
+class IncrementalCheckpointer(BaseReporter):
+    """
+    Checkpoints a population at the end of every generation without holding up training. A full copy is written
+    every full_interval generations and only the genomes that are new since the previous checkpoint in between. All
+    compression and disk writes happen on a background thread.
+
+    It also keeps a journal of the evaluations finished in the current generation, written as they arrive, so that
+    restore can continue an interrupted generation instead of redoing it.
+    """
+
+    def __init__(self, directory, full_interval=10, keep_full=2):
+        self.directory = directory
+        self.full_interval = full_interval
+        self.keep_full = keep_full
+        os.makedirs(directory, exist_ok=True)
+
+        self.generation = None
+        self.known = None  # key -> genome as of the last checkpoint, None until a full one is written
+        self.last_full = None
+
+        self.writes = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        self.journal_file = None
+        atexit.register(self.close)
+
+    # ==== checkpoints ==== #
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.writes.put(('journal', generation))
+
+    def end_generation(self, config, population, species_set):
+        self.save(config, population, species_set, self.generation + 1)  # the population is the next generation's
+
+    def begin(self, p):
+        """
+        Writes the population a run starts from, unless a checkpoint of that generation already exists.
+        """
+        if self.known is None and not os.path.exists(self.path(p.generation, 'full')):
+            self.save(p.config, p.population, p.species, p.generation)
+
+    def save(self, config, population, species_set, generation):
+        """
+        Queues a checkpoint of the given population, which is the start of generation. The state is pickled here,
+        since neat changes it as soon as this returns.
+        """
+        needed = dict(population)
+        for s in species_set.species.values():
+            needed[s.representative.key] = s.representative
+
+        full = self.known is None or generation - self.last_full >= self.full_interval
+        genomes = needed if full else dict((k, g) for k, g in needed.items() if k not in self.known)
+
+        state = {'generation': generation,
+                 'population': list(population),
+                 'genomes': genomes,
+                 'species': [{'key': s.key, 'created': s.created, 'last_improved': s.last_improved,
+                              'representative': s.representative.key, 'members': list(s.members),
+                              'fitness': s.fitness, 'adjusted_fitness': s.adjusted_fitness,
+                              'fitness_history': list(s.fitness_history)} for s in species_set.species.values()],
+                 'next_species': max(list(species_set.species) + [0]) + 1,
+                 'next_genome': max(list(needed) + [0]) + 1,
+                 'node_indexer': config.genome_config.node_indexer,  # shared by every genome, so not derivable
+                 'rndstate': random.getstate()}
+
+        self.writes.put(('checkpoint', (generation, 'full' if full else 'delta',
+                                        pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))))
+
+        self.known = needed
+        if full:
+            self.last_full = generation
+
+    def path(self, generation, kind):
+        return os.path.join(self.directory, 'gen-{0:06d}.{1}.gz'.format(generation, kind))
+
+    def journal_path(self, generation):
+        return os.path.join(self.directory, 'results-{0:06d}.pkl'.format(generation))
+
+    # ==== evaluation journal ==== #
+
+    def record(self, key, fitness, truncated=False):
+        """
+        Journals one finished evaluation of the current generation. key identifies the job (see cache.job_key).
+        """
+        self.writes.put(('record', (key, fitness, truncated)))
+
+    def completed(self, generation=None):
+        """
+        Returns key -> (fitness, truncated) for every evaluation journalled in a generation, by default the current
+        one.
+        """
+        if generation is None:
+            generation = self.generation
+
+        self.flush()
+        done = {}
+        path = self.journal_path(generation)
+        if not os.path.exists(path):
+            return done
+
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    key, fitness, truncated = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError):  # the end, or a record cut short by a crash
+                    break
+                done[key] = (fitness, truncated)
+
+        return done
+
+    # ==== background writer ==== #
+
+    def write_loop(self):
+        while True:
+            kind, item = self.writes.get()
+            try:
+                if kind == 'checkpoint':
+                    self.write_checkpoint(*item)
+                elif kind == 'journal':
+                    self.open_journal(item)
+                elif kind == 'record':
+                    pickle.dump(item, self.journal_file)
+                    self.journal_file.flush()
+                    os.fsync(self.journal_file.fileno())
+            except Exception as e:
+                print("Checkpoint write failed: {0!r}".format(e))
+            finally:
+                self.writes.task_done()
+
+    def write_checkpoint(self, generation, kind, data):
+        path = self.path(generation, kind)
+        with gzip.open(path + '.tmp', 'wb', compresslevel=5) as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)  # a crash mid-write never leaves a broken checkpoint behind
+
+        if kind == 'full':
+            self.prune()
+
+    def open_journal(self, generation):
+        if self.journal_file is not None:
+            self.journal_file.close()
+        self.journal_file = open(self.journal_path(generation), 'ab')
+
+        for name in os.listdir(self.directory):  # earlier journals are covered by the checkpoints
+            match = re.match(r'results-(\d+)\.pkl$', name)
+            if match and int(match.group(1)) < generation:
+                os.remove(os.path.join(self.directory, name))
+
+    def prune(self):
+        """
+        Deletes checkpoints older than the last keep_full full ones.
+        """
+        files = list_checkpoints(self.directory)
+        fulls = [generation for generation, kind in files if kind == 'full']
+        if len(fulls) <= self.keep_full:
+            return
+
+        oldest = fulls[-self.keep_full]
+        for generation, kind in files:
+            if generation < oldest:
+                os.remove(self.path(generation, kind))
+
+    def flush(self):
+        self.writes.join()
+
+    def close(self):
+        self.flush()
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+    # ==== restore ==== #
+
+    def restore(self, config):
+        """
+        Rebuilds the population from the latest full checkpoint in the directory and the deltas written after it.
+        Returns a neat Population ready to run, or None if there is nothing to restore. The checkpointer carries on
+        writing deltas from there.
+        """
+        files = list_checkpoints(self.directory)
+        fulls = [i for i, (_, kind) in enumerate(files) if kind == 'full']
+        if not fulls:
+            return None
+
+        genomes = {}
+        for generation, kind in files[fulls[-1]:]:
+            with gzip.open(self.path(generation, kind)) as f:
+                state = pickle.load(f)
+            if kind == 'full':
+                genomes = {}
+            genomes.update(state['genomes'])
+            genomes = dict((k, genomes[k]) for k in set(state['population']) |
+                           set(s['representative'] for s in state['species']))
+
+        p = neat.Population(config, initial_state=({}, None, state['generation']))
+        p.population = dict((k, genomes[k]) for k in state['population'])
+
+        species_set = config.species_set_type(config.species_set_config, p.reporters)
+        for data in state['species']:
+            s = Species(data['key'], data['created'])
+            s.last_improved = data['last_improved']
+            s.representative = genomes[data['representative']]
+            s.members = dict((k, genomes[k]) for k in data['members'])
+            s.fitness = data['fitness']
+            s.adjusted_fitness = data['adjusted_fitness']
+            s.fitness_history = data['fitness_history']
+            species_set.species[s.key] = s
+            for k in s.members:
+                species_set.genome_to_species[k] = s.key
+        species_set.indexer = count(state['next_species'])
+        p.species = species_set
+
+        p.reproduction.genome_indexer = count(state['next_genome'])  # neat restarts it at 1, reusing live keys
+        config.genome_config.node_indexer = state['node_indexer']
+        random.setstate(state['rndstate'])
+
+        self.known = genomes
+        self.last_full = files[fulls[-1]][0]
+        print("Restored generation {0} from {1}".format(state['generation'], self.directory))
+
+        return p
+
+
+def list_checkpoints(directory):
+    """
+    Returns (generation, kind) for every checkpoint in a directory, oldest first.
+    """
+    files = []
+    for name in os.listdir(directory):
+        match = re.match(r'gen-(\d+)\.(full|delta)\.gz$', name)
+        if match:
+            files.append((int(match.group(1)), match.group(2)))
+
+    return sorted(files)
@@ -0,0 +1,180 @@
+from constants import compare_confidence, compare_initial_seeds, compare_max_seeds
+import math
+import statistics
+import workers
+from functools import lru_cache
+
+
+def t_within(t, df):
+    """
+    Returns the probability that a Student t variable with df degrees of freedom lies within [-t, t], from the
+    closed forms for whole degrees of freedom (Abramowitz and Stegun 26.7.3).
+    """
+    theta = math.atan(t / math.sqrt(df))
+    cos2 = math.cos(theta) ** 2
+    term = total = 1.0
+    for k in range(1 + df % 2, df - 1, 2):
+        term *= cos2 * k / (k + 1)
+        total += term
+
+    if df % 2:
+        return 2 / math.pi * (theta + (math.sin(theta) * math.cos(theta) * total if df > 1 else 0.0))
+    return math.sin(theta) * total
+
+
+@lru_cache(maxsize=None)
+def t_critical(alpha, df):
+    """
+    Returns the t that a Student t variable with df degrees of freedom exceeds in absolute value with probability
+    alpha, found by bisecting on the angle atan(t / sqrt(df)).
+    """
+    low, high = 0.0, math.pi / 2
+    for _ in range(100):
+        mid = (low + high) / 2
+        if t_within(math.sqrt(df) * math.tan(mid), df) < 1 - alpha:
+            low = mid
+        else:
+            high = mid
+
+    return math.sqrt(df) * math.tan((low + high) / 2)
+
+
+class PairedComparison:
+    """
+    Ranks stored genomes and the baseline by running them all on the same seeds, so that every pair is judged on its
+    per-seed differences. That cancels out how hard each seed is, which separate runs (as in get_genome_stats) pay
+    for with many more seeds. Seeds are run in rounds, initial_seeds first and then doubling as in racing, until every
+    two candidates next to each other in the ranking are told apart at the given confidence or max_seeds is reached.
+
+    The confidence covers every pair and every round at once: each test runs at the error rate left after splitting
+    1 - confidence over all the pairs and all the rounds that could be run (Bonferroni), so stopping at the first
+    round that looks separated does not overstate it. The spread of the differences is estimated from the seeds run,
+    so each test takes its critical value from Student's t with one degree of freedom less than the seeds. Scores are
+    positive (lower is better), as in the stats files under data/.
+    """
+
+    def __init__(self, candidates, config=None, confidence=compare_confidence, initial_seeds=compare_initial_seeds,
+                 max_seeds=compare_max_seeds, first_seed=0):
+        """
+        candidates maps a name to a genome, or to None for the baseline.
+        """
+        if len(candidates) < 2:
+            raise ValueError("A comparison needs at least two candidates.")
+        if initial_seeds < 2:
+            raise ValueError("A paired comparison needs at least two initial seeds to estimate its spread.")
+        if config is None and any(genome is not None for genome in candidates.values()):
+            raise ValueError("You need to provide a config if evaluating genomes")
+
+        self.candidates = dict(candidates)
+        self.config = config
+        self.confidence = confidence
+        self.initial_seeds = initial_seeds
+        self.max_seeds = max_seeds
+        self.first_seed = first_seed
+
+        self.scores = dict((name, []) for name in self.candidates)
+        self.runs = 0
+        self.simulated = 0  # runs that were not already in the evaluation cache
+
+        pairs = len(self.candidates) * (len(self.candidates) - 1) / 2
+        self.alpha = (1 - confidence) / (pairs * self.rounds())
+
+    def rounds(self):
+        """
+        Returns how many rounds it takes to reach max_seeds.
+        """
+        seeds, rounds = min(self.initial_seeds, self.max_seeds), 1
+        while seeds < self.max_seeds:
+            seeds, rounds = min(self.max_seeds, 2 * seeds), rounds + 1
+
+        return rounds
+
+    def seeds(self):
+        return len(next(iter(self.scores.values())))
+
+    def critical(self):
+        """
+        Returns the critical value of each test on the seeds run so far.
+        """
+        return t_critical(self.alpha, self.seeds() - 1)
+
+    def run(self, num=None):
+        """
+        Runs rounds of seeds on the worker pool until the ranking is resolved or the seed budget is spent, and returns
+        the ranking.
+        """
+        pool = workers.get_pool(num)
+        names = list(self.candidates)
+
+        while self.seeds() < self.max_seeds:
+            done = self.seeds()
+            new_seeds = range(self.first_seed + done,
+                              self.first_seed + min(self.max_seeds, max(self.initial_seeds, 2 * done)))
+            jobs = [(self.candidates[name], seed) for name in names for seed in new_seeds]
+            fitnesses = pool.evaluate(jobs, self.config)
+
+            for k, name in enumerate(names):
+                self.scores[name].extend(-1 * f for f in fitnesses[k * len(new_seeds): (k + 1) * len(new_seeds)])
+            self.runs += len(jobs)
+            self.simulated += sum(metrics is not None for metrics in pool.metrics)
+
+            if self.resolved():
+                break
+
+        return self.ranking()
+
+    def ranking(self):
+        """
+        Returns the candidate names from best (lowest mean score) to worst.
+        """
+        return sorted(self.scores, key=lambda name: statistics.mean(self.scores[name]))
+
+    def difference(self, a, b):
+        """
+        Returns the mean per-seed difference in score of a over b, its standard error and its effect size (the mean
+        difference over the standard deviation of the differences, Cohen's d for paired samples).
+        """
+        differences = [x - y for x, y in zip(self.scores[a], self.scores[b])]
+        mean = statistics.mean(differences)
+        stdev = statistics.stdev(differences)
+        effect = mean / stdev if stdev else float('inf') if mean else 0.0
+
+        return mean, stdev / len(differences) ** 0.5, effect
+
+    def separated(self, a, b):
+        mean, error, _ = self.difference(a, b)
+        return abs(mean) > self.critical() * error
+
+    def resolved(self):
+        """
+        Whether every candidate is told apart from the next one in the ranking.
+        """
+        ranking = self.ranking()
+        return all(self.separated(a, b) for a, b in zip(ranking, ranking[1:]))
+
+    def report(self):
+        """
+        Returns the ranking with each candidate's mean score, and the difference, confidence interval and effect size
+        between each candidate and the next.
+        """
+        ranking = self.ranking()
+        full = self.max_seeds * len(self.candidates)
+        lines = ["{0} candidates on {1} shared seeds, {2} runs ({3} simulated) of the {4} a full comparison takes. "
+                 "Ranking {5} at {6:.0%} confidence".format(len(ranking), self.seeds(), self.runs, self.simulated, full,
+                                                            'resolved' if self.resolved() else 'not resolved',
+                                                            self.confidence)]
+
+        width = max(len(name) for name in ranking)
+        for i, name in enumerate(ranking):
+            scores = self.scores[name]
+            lines.append("  {0}. {1:<{2}}  mean {3:8.3f}, stdev {4:7.3f}".format(
+                i + 1, name, width, statistics.mean(scores), statistics.stdev(scores)))
+
+        critical = self.critical()
+        for a, b in zip(ranking, ranking[1:]):
+            mean, error, effect = self.difference(a, b)
+            lines.append("  {0} vs {1}: {2:+.3f} [{3:+.3f}, {4:+.3f}], effect size {5:.2f}{6}".format(
+                a, b, mean, mean - critical * error, mean + critical * error, effect,
+                '' if self.separated(a, b) else ', not separated'))
+
+        return '\n'.join(lines)
@@ -0,0 +1,238 @@
+from neat.graphs import required_for_output
+import numpy as np
+
+
+def sigmoid(z):  # tiny outputs decide argmax ties between saturated pairs, so keep neat's exact formula
+    t = np.multiply(z, -5.0)
+    np.minimum(t, 60.0, out=t)  # in place, np.clip is several times slower on arrays this small
+    np.maximum(t, -60.0, out=t)
+    np.exp(t, out=t)
+    t += 1.0
+    return np.reciprocal(t, out=t)
+
+
+def tanh(z):
+    return np.tanh(np.clip(2.5 * z, -60.0, 60.0))
+
+
+def relu(z):
+    return np.maximum(z, 0.0)
+
+
+def identity(z):
+    return z
+
+
+def clamped(z):
+    return np.clip(z, -1.0, 1.0)
+
+
+activations = {'sigmoid': sigmoid, 'tanh': tanh, 'relu': relu, 'identity': identity, 'clamped': clamped}
+
+
+class CompiledCTRNN:
+    """
+    An array-backed drop-in for neat.ctrnn.CTRNN. Only the nodes neat-python would evaluate are kept, and every Euler
+    step is a pair of matrix-vector products.
+    """
+
+    def __init__(self, input_nodes, output_nodes, node_keys, input_weights, node_weights, biases, time_constants,
+                 activation_groups):
+        self.input_nodes = input_nodes
+        self.output_nodes = output_nodes
+        self.node_keys = node_keys
+
+        self.input_weights = input_weights
+        self.node_weights = node_weights
+        self.biases = biases
+        self.time_constants = time_constants
+        self.activation_groups = activation_groups
+
+        # outputs that neat-python never evaluates read a padding slot past the real nodes, its infinite time
+        # constant keeps it at zero
+        index = dict((k, i) for i, k in enumerate(node_keys))
+        self.output_index = np.array([index.get(k, len(node_keys)) for k in output_nodes], dtype=np.intp)
+
+        self.values = [np.zeros(len(node_keys) + 1), np.zeros(len(node_keys) + 1)]
+        self.active = 0
+        self.time_seconds = 0.0
+
+        self.rate_step = None
+        self.rates = None
+
+    def reset(self):
+        for v in self.values:
+            v[:] = 0.0
+        self.active = 0
+        self.time_seconds = 0.0
+
+    def advance(self, inputs, advance_time, time_step):
+        """
+        Advance the simulation by the given amount of time, assuming that inputs are constant at the given values
+        during the simulated time. Steps exactly as neat.ctrnn.CTRNN.advance does, including its alternating buffers.
+        """
+        final_time_seconds = self.time_seconds + advance_time
+
+        if len(self.input_nodes) != len(inputs):
+            raise RuntimeError("Expected {0} inputs, got {1}".format(len(self.input_nodes), len(inputs)))
+
+        drive = self.biases + self.input_weights @ np.asarray(inputs, dtype=float)  # constant over the interval
+
+        while self.time_seconds < final_time_seconds:
+            dt = min(time_step, final_time_seconds - self.time_seconds)
+            if dt != self.rate_step:
+                self.rate_step = dt
+                self.rates = dt / self.time_constants
+
+            ivalues = self.values[self.active]
+            ovalues = self.values[1 - self.active]
+            self.active = 1 - self.active
+
+            s = drive + self.node_weights @ ivalues
+            if len(self.activation_groups) == 1:
+                z = self.activation_groups[0][0](s)
+            else:
+                z = np.zeros(len(s))
+                for activation, nodes in self.activation_groups:
+                    z[nodes] = activation(s[nodes])
+
+            ovalues += self.rates * (z - ovalues)
+
+            self.time_seconds += dt
+
+        return self.values[1 - self.active][self.output_index].tolist()
+
+    @staticmethod
+    def create(genome, config, time_constant):
+        """ Receives a genome and returns its compiled phenotype, mirroring neat.ctrnn.CTRNN.create. """
+        genome_config = config.genome_config
+        required = required_for_output(genome_config.input_keys, genome_config.output_keys, genome.connections)
+
+        # Gather inputs and expressed connections.
+        node_inputs = {}
+        for cg in genome.connections.values():
+            if not cg.enabled:
+                continue
+
+            i, o = cg.key
+            if o not in required and i not in required:
+                continue
+
+            node_inputs.setdefault(o, []).append((i, cg.weight))
+
+        node_keys = list(node_inputs.keys())
+        node_index = dict((k, i) for i, k in enumerate(node_keys))
+        input_index = dict((k, i) for i, k in enumerate(genome_config.input_keys))
+
+        n = len(node_keys)
+        input_weights = np.zeros((n + 1, len(input_index)))
+        node_weights = np.zeros((n + 1, n + 1))
+        biases = np.zeros(n + 1)
+        time_constants = np.full(n + 1, float(time_constant))
+        time_constants[n] = np.inf
+        groups = {}
+
+        for row, node_key in enumerate(node_keys):
+            node = genome.nodes[node_key]
+            if node.aggregation != 'sum':
+                raise ValueError("Only sum aggregation can be compiled, node {0} uses {1}".format(node_key,
+                                                                                                node.aggregation))
+            if node.activation not in activations:
+                raise ValueError("No compiled form of the {0} activation".format(node.activation))
+
+            biases[row] = node.bias
+            groups.setdefault(node.activation, []).append(row)
+
+            for i, w in node_inputs[node_key]:  # the response is folded into the weights
+                if i in input_index:
+                    input_weights[row, input_index[i]] += node.response * w
+                elif i in node_index:
+                    node_weights[row, node_index[i]] += node.response * w
+                # any other source is a node neat-python never evaluates, so it always reads as zero
+
+        activation_groups = [(activations[name], np.array(rows, dtype=np.intp)) for name, rows in groups.items()]
+
+        return CompiledCTRNN(genome_config.input_keys, genome_config.output_keys, node_keys, input_weights,
+                             node_weights, biases, time_constants, activation_groups)
+
+
+class BatchCTRNN:
+    """
+    Several compiled nets stacked into padded 3-d arrays so that all of them advance with one batched matrix product
+    per Euler step. Each net keeps its own clock and buffer, so nets can be advanced by different amounts of time and
+    still step exactly as a CompiledCTRNN given the same advance calls.
+    """
+
+    def __init__(self, nets):
+        k = len(nets)
+        m = max(len(net.biases) for net in nets)
+        num_inputs = nets[0].input_weights.shape[1]
+
+        self.input_weights = np.zeros((k, m, num_inputs))
+        self.node_weights = np.zeros((k, m, m))
+        self.biases = np.zeros((k, m))
+        self.time_constants = np.full((k, m), np.inf)  # padding slots never move off zero
+        self.output_index = np.array([net.output_index for net in nets], dtype=np.intp)
+
+        groups = {}
+        for i, net in enumerate(nets):
+            size = len(net.biases)
+            self.input_weights[i, :size] = net.input_weights
+            self.node_weights[i, :size, :size] = net.node_weights
+            self.biases[i, :size] = net.biases
+            self.time_constants[i, :size] = net.time_constants
+
+            for activation, nodes in net.activation_groups:
+                groups.setdefault(activation, []).extend(i * m + nodes)
+
+        self.activation_groups = [(activation, np.array(nodes, dtype=np.intp)) for activation, nodes in groups.items()]
+
+        self.rows = np.arange(k)
+        self.values = np.zeros((2, k, m))
+        self.active = np.zeros(k, dtype=np.intp)  # the buffer each net reads from next
+        self.time_seconds = np.zeros(k)
+
+    def reset(self):
+        self.values[:] = 0.0
+        self.active[:] = 0
+        self.time_seconds[:] = 0.0
+
+    def advance(self, inputs, advance_time, time_step):
+        """
+        Advances every net by the given amount of time, or each by its own if advance_time is a sequence. inputs holds
+        one row of inputs per net, and the outputs come back the same way.
+        """
+        final_time_seconds = self.time_seconds + np.broadcast_to(np.asarray(advance_time, dtype=float),
+                                                                 self.time_seconds.shape)
+
+        inputs = np.asarray(inputs, dtype=float)
+        drive = self.biases + np.matmul(self.input_weights, inputs[:, :, None])[:, :, 0]
+
+        while True:
+            moving = self.time_seconds < final_time_seconds
+            if not moving.any():
+                break
+
+            dt = np.minimum(time_step, final_time_seconds - self.time_seconds)
+            rates = dt[:, None] / self.time_constants
+
+            ivalues = self.values[self.active, self.rows]
+            ovalues = self.values[1 - self.active, self.rows]
+
+            s = drive + np.matmul(self.node_weights, ivalues[:, :, None])[:, :, 0]
+            if len(self.activation_groups) == 1:
+                z = self.activation_groups[0][0](s)
+            else:
+                z = np.zeros(s.shape)
+                for activation, nodes in self.activation_groups:
+                    z.flat[nodes] = activation(s.flat[nodes])
+
+            ovalues += rates * (z - ovalues)
+
+            # only the nets still short of their time take the step, the others keep their buffers as they are
+            rows = self.rows[moving]
+            self.values[1 - self.active[moving], rows] = ovalues[moving]
+            self.active[moving] = 1 - self.active[moving]
+            self.time_seconds[moving] += dt[moving]
+
+        return np.take_along_axis(self.values[1 - self.active, self.rows], self.output_index, axis=1)
@@ -1,7 +1,44 @@
 t_step = 0.2  # simulation time_step for sumo and ctrnn
 runtime = 400
 sumoCmd = ['sumo', '-c', 'sumo/cbd/tinycbd.sumocfg', '--step-length', str(t_step)]
-use_libsumo = False  # simulations run faster if true, but gui only works if false
+backend = 'traci'  # sumo bindings for Evaluators made directly: 'traci' (needed for the gui), 'libsumo' or 'fastest'
+worker_backend = 'fastest'  # bindings for pool workers, fastest is libsumo when it is installed
 total_steps = int(runtime / t_step)
 lock_time = 8  # lock time in seconds
 limit_time = 50  # maximum time before lights change automatically
+use_snapshots = False  # restore a saved warm-up state instead of replaying it, approximate (see restore_snapshot)
+warmup_time = 0  # seconds run under the default timings before the controller takes over
+batch_size = 1  # simulations each worker steps in lockstep, values above 1 use labelled traci connections
+use_cache = True  # reuse stored fitnesses for genomes and baselines already run on the same scenario and seed
+cache_path = 'data/eval_cache.sqlite'
+cache_max_entries = 1000000
+use_racing = False  # race genomes over the training seeds instead of running every genome on all of them
+racing_initial_seeds = 5  # seeds every genome is run on before any can drop out
+racing_z = 1.0  # standard errors of slack a genome gets before it drops out of the race
+cutoff_percentile = None  # e.g. 10 stops training runs sure to score below the previous generation's 10th percentile
+control_period = 1  # simulation steps between net decisions, the ctrnn still integrates at t_step
+verify_phases = False  # check the locally tracked light phases against sumo on every step (slow, for debugging)
+coordinator_address = None  # e.g. ('192.168.1.10', 6100) serves training jobs to workers on a trusted network
+coordinator_authkey_file = 'coordinator.key'  # holds the coordinator's secret, unless NEAT_SUMO_AUTHKEY is set
+checkpoint_dir = 'neat/cbd/checkpoints'  # where training checkpoints and resumes from, None turns checkpointing off
+checkpoint_full_interval = 10  # generations between full checkpoints, the ones between only store new genomes
+profile_evaluator = False  # time the hot-path sections of the Evaluator and count traci calls, reported per generation
+use_generated_demand = False  # sample each seed's trips in memory (demand.py) instead of loading the route file
+demand_weights = 'weights'  # prefix of the randomTrips weight files beside the sumocfg (.src.xml, .dst.xml)
+demand_period = 1.0  # mean seconds between generated departures, as randomTrips --period
+demand_end = 100  # seconds over which generated vehicles depart, as randomTrips --end
+demand_binomial = 100  # trials per second for the departure count, as randomTrips --binomial
+topology_dir = 'data/topology'  # cached network topology indexes (topology.py), rebuilt when their sources change
+compare_confidence = 0.95  # confidence a paired comparison (comparison.py) needs before it stops early
+compare_initial_seeds = 10  # seeds every candidate in a comparison runs before the first test
+compare_max_seeds = 1000  # seed budget of a comparison that never separates its candidates
+use_screening = False  # screen every genome with short runs and only run the most promising in full
+screen_fraction = 0.25  # share of each generation promoted from the screen to the full evaluation
+screen_seeds = 3  # seeds each genome is screened on
+screen_time = 200  # seconds simulated by a screening run, the full runs simulate runtime
+screen_audit = 2  # genomes screened out that are still run in full each generation, to check the tiers agree
+use_islands = False  # evolve several populations at once on the shared workers (train.run_islands) instead of one
+islands = 4  # populations in an island run, each seeded differently
+migration_interval = 5  # generations an island runs between sending its best genomes on to the next island
+migration_size = 2  # genomes an island sends at each migration
+trace_dir = 'data/traces'  # recorded net decisions (recording.py) that can be replayed in sumo-gui without the net
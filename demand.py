@@ -0,0 +1,119 @@
+from constants import demand_period, demand_end, demand_binomial
+import os
+import re
+import numpy as np
+import sumolib
+
+vehicle_class = 'passenger'
+
+
+def read_weights(path):
+    """
+    Reads a randomTrips edge weight file (edgedata with one value per edge), returning edge id -> weight, or None if
+    there is no such file. The edges are matched one by one rather than parsed as xml, as randomTrips does not need
+    the file to be well formed (the one for cbd closes its interval twice).
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        text = f.read()
+
+    weights = {}
+    for element in re.findall(r'<edge\b[^>]*>', text):
+        attributes = dict(re.findall(r'(\w+)="([^"]*)"', element))
+        weights[attributes['id']] = weights.get(attributes['id'], 0.0) + float(attributes['value'])
+
+    return weights
+
+
+class DemandModel:
+    """
+    Samples randomTrips style demand in memory, so that every seed gets its own set of trips without running
+    randomTrips and duarouter or reparsing a route file. The net and weights are parsed, and the route between every
+    source and destination found, once when the model is made.
+
+    As with randomTrips --fringe-factor max, vehicles start and end on fringe edges. Sources and destinations are
+    picked by the weights in prefix.src.xml and prefix.dst.xml when they exist (edges they leave out are never picked)
+    and uniformly when they do not. Each second up to end, binomial trials each start a vehicle with probability
+    1 / (period * binomial), and as with --validate trips with no route are dropped.
+    """
+
+    def __init__(self, net_file, weights_prefix=None, period=demand_period, end=demand_end, binomial=demand_binomial):
+        net = sumolib.net.readNet(net_file)
+        self.period = period
+        self.end = end
+        self.binomial = binomial
+
+        edges = [edge for edge in net.getEdges() if edge.allows(vehicle_class)]
+        sources = [edge for edge in edges if edge.is_fringe(edge.getIncoming())]
+        sinks = [edge for edge in edges if edge.is_fringe(edge.getOutgoing())]
+
+        src_weights = read_weights(weights_prefix + '.src.xml') if weights_prefix else None
+        dst_weights = read_weights(weights_prefix + '.dst.xml') if weights_prefix else None
+        p_src = self.probabilities(sources, src_weights)
+        p_dst = self.probabilities(sinks, dst_weights)
+
+        self.routes = []  # edge ids of every source -> destination pair that can be driven
+        probabilities = []
+        for i, source in enumerate(sources):
+            for j, sink in enumerate(sinks):
+                if p_src[i] == 0 or p_dst[j] == 0:
+                    continue
+
+                path, _ = net.getShortestPath(source, sink, vClass=vehicle_class)
+                if path is not None:
+                    self.routes.append(tuple(edge.getID() for edge in path))
+                    probabilities.append(p_src[i] * p_dst[j])
+
+        if not self.routes:
+            raise ValueError("No routes between the weighted fringe edges of {0}.".format(net_file))
+
+        # a trip picks its source and destination independently, so the pairs with no route are the share dropped
+        self.valid = sum(probabilities)
+        self.probabilities = np.array(probabilities) / self.valid
+
+    @staticmethod
+    def probabilities(edges, weights):
+        if weights is None:
+            values = [1.0 for _ in edges]
+        else:
+            values = [weights.get(edge.getID(), 0.0) for edge in edges]
+
+        total = sum(values)
+        return [value / total if total else 0.0 for value in values]
+
+    def sample(self, seed):
+        """
+        Returns the trips of one demand realisation as (depart time, route index) pairs in departure order. The same
+        seed always gives the same trips.
+        """
+        rng = np.random.default_rng(seed)
+        seconds = np.arange(0, self.end)
+        counts = rng.binomial(self.binomial, min(1.0, 1 / (self.period * self.binomial)), size=len(seconds))
+        counts = rng.binomial(counts, self.valid)  # drop the trips that would fail validation
+        departs = np.repeat(seconds, counts)
+        routes = rng.choice(len(self.routes), size=len(departs), p=self.probabilities)
+
+        return list(zip(departs.tolist(), routes.tolist()))
+
+    def inject(self, conn, seed, begin=0, end=None):
+        """
+        Adds the trips for a seed that depart from begin up to (not including) end to the simulation, along with any
+        routes they use that it does not have yet. Returns how many vehicles were added.
+        """
+        known = set(conn.route.getIDList())  # routes are cleared by a load but kept in a saved state
+        added = 0
+        for i, (depart, route) in enumerate(self.sample(seed)):
+            if depart < begin or (end is not None and depart >= end):
+                continue
+
+            route_id = 'demand_{0}'.format(route)
+            if route_id not in known:
+                conn.route.add(route_id, self.routes[route])
+                known.add(route_id)
+
+            conn.vehicle.add(str(i), route_id, typeID='DEFAULT_VEHTYPE', depart=str(depart))
+            added += 1
+
+        return added
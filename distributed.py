@@ -0,0 +1,213 @@
+from constants import sumoCmd, total_steps, use_cache, worker_backend, coordinator_address, coordinator_authkey_file
+import atexit
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import cache
+import evaluation
+import workers
+from multiprocessing.connection import Listener, Client
+
+
+def get_authkey():
+    """
+    Returns the shared secret of the coordinator and its workers: the NEAT_SUMO_AUTHKEY environment variable if set,
+    otherwise the contents of coordinator_authkey_file. Jobs and results are pickled, so anyone holding the key can run
+    code on the other end, and there is no default. Raises RuntimeError when neither is there.
+    """
+    key = os.environ.get('NEAT_SUMO_AUTHKEY')
+    if key:
+        return key.encode()
+
+    if os.path.exists(coordinator_authkey_file):
+        with open(coordinator_authkey_file, 'rb') as f:
+            key = f.read().strip()
+        if key:
+            return key
+
+    raise RuntimeError("No coordinator authkey: set NEAT_SUMO_AUTHKEY or write a secret to {0}, e.g. with python -c "
+                       "\"import secrets; print(secrets.token_hex(32))\" > {0}".format(coordinator_authkey_file))
+
+
+class Coordinator(workers.EvaluationPool):
+    """
+    Serves (genome, seed) jobs over TCP to any number of remote workers, each with its own Evaluator, with the same
+    evaluate interface as the local pool. Workers can join and leave at any time: the job a worker held when its
+    connection dropped goes back on the queue for another worker. evaluate waits for as long as it takes a worker to
+    connect. Without an authkey it is read with get_authkey, which refuses to start without one.
+    """
+
+    def __init__(self, address=coordinator_address, authkey=None, sumo_cmd=sumoCmd, runtime=total_steps,
+                 cached=use_cache):
+        if authkey is None:
+            authkey = get_authkey()
+
+        self.sumo_cmd = sumo_cmd
+        self.runtime = runtime
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.processes = []
+        self.profiles = {}
+        self.connections = set()
+        self.lock = threading.Lock()
+
+        self.listener = Listener(tuple(address), authkey=authkey)
+        self.address = self.listener.address  # the real port if port 0 was asked for
+        self.num = None  # the worker count is whatever connects
+
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+        self.cache = cache.EvaluationCache() if cached else None
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except multiprocessing.AuthenticationError:
+                print("Rejected a worker with the wrong authkey")
+                continue
+            except OSError:  # the listener was closed
+                break
+
+            peer = '{0}:{1}'.format(*self.listener.last_accepted)
+            threading.Thread(target=self.serve, args=(conn, peer), daemon=True).start()
+
+    def serve(self, conn, peer):
+        """
+        Feeds jobs to one worker connection, one at a time, until the coordinator closes or the worker goes away.
+        """
+        try:
+            conn.send((self.sumo_cmd, self.runtime))
+        except OSError:
+            return
+
+        with self.lock:
+            self.connections.add(conn)
+        print("Worker {0} connected ({1} in total)".format(peer, len(self.connections)))
+
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                break
+
+            try:
+                conn.send(task)
+                result = conn.recv()
+            except (EOFError, OSError):
+                self.tasks.put(task)  # hand the job to another worker
+                print("Worker {0} disconnected, job {1} requeued".format(peer, task[0]))
+                break
+
+            if result[4] is not None:  # pids are only unique per machine
+                result = result[:4] + (('{0}/{1}'.format(peer, result[4][0]), result[4][1]),) + result[5:]
+            self.results.put(result)
+
+        with self.lock:
+            self.connections.discard(conn)
+        conn.close()
+
+    def close(self):
+        self.listener.close()
+
+        with self.lock:
+            connected = len(self.connections)
+        for _ in range(connected):
+            self.tasks.put(None)
+
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+def worker_main(address, authkey=None, backend=worker_backend, retry=5.0):
+    """
+    Body of a remote worker. Connects to the coordinator (retrying every retry seconds until it is up), starts an
+    Evaluator for the scenario it is sent and runs jobs until the coordinator closes the connection. The authkey
+    defaults to get_authkey.
+    """
+    if authkey is None:
+        authkey = get_authkey()
+
+    while True:
+        try:
+            conn = Client(tuple(address), authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            time.sleep(retry)
+
+    try:
+        sumo_cmd, runtime = conn.recv()
+        ev = evaluation.Evaluator.create(sumo_cmd=sumo_cmd, runtime=runtime, backend=backend)
+
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            conn.send(workers.run_task(ev, sumo_cmd, task))
+    except EOFError:  # the coordinator went away
+        pass
+    finally:
+        conn.close()
+
+
+def start_workers(address, num=None, authkey=None, backend=worker_backend, retry=5.0):
+    """
+    Starts num worker processes (one per core by default) that connect to the coordinator at address, and returns
+    them.
+    """
+    if num is None:
+        num = multiprocessing.cpu_count()
+
+    if authkey is None:  # fail here rather than in every worker
+        authkey = get_authkey()
+
+    processes = []
+    for _ in range(num):
+        proc = multiprocessing.Process(target=worker_main, args=(address, authkey, backend, retry),
+                                       daemon=True)
+        proc.start()
+        processes.append(proc)
+
+    return processes
+
+
+_coordinator = None
+
+
+def get_coordinator():
+    """
+    Returns the coordinator for this process, listening on coordinator_address from its first use.
+    """
+    global _coordinator
+
+    if _coordinator is None:
+        _coordinator = Coordinator()
+
+    return _coordinator
+
+
+@atexit.register
+def close_coordinator():
+    global _coordinator
+
+    if _coordinator is not None:
+        _coordinator.close()
+        _coordinator = None
+
+
+if __name__ == '__main__':
+    # python distributed.py HOST PORT [PROCESSES] runs workers for the coordinator at HOST:PORT on this machine
+    if len(sys.argv) < 3:
+        print("usage: python distributed.py HOST PORT [PROCESSES]")
+        sys.exit(1)
+
+    procs = start_workers((sys.argv[1], int(sys.argv[2])), int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    for p in procs:
+        p.join()
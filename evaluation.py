@@ -1,13 +1,48 @@
-from constants import sumoCmd, t_step, use_libsumo, total_steps, lock_time, limit_time
+from constants import sumoCmd, t_step, total_steps, lock_time, limit_time, use_snapshots, warmup_time
+from constants import control_period, verify_phases, profile_evaluator, use_generated_demand, demand_weights
 
-if use_libsumo:
-    import libsumo as traci
-else:
-    import traci
+import backends
+import topology
+import traci
 import neat
+import os
+import shutil
+import tempfile
 import xml.etree.ElementTree as ET
 from enum import Enum
+from functools import lru_cache
 from numpy import argmax
+from compiled_ctrnn import CompiledCTRNN
+from demand import DemandModel
+from topology import get_input_files
+from timeloss import TimeLossAggregator
+from profiling import Profiler
+from recording import Trace
+
+
+snapshot_options = ['--save-state.rng', '--save-state.precision', '17']  # a restore must match a replay exactly
+
+# Evaluator methods timed when profiling, and the section each one is reported under
+profiled_sections = {'reset': 'reset', 'do_timestep': 'time_limit', 'poll_subscriptions': 'get_inputs',
+                     'update_time_loss': 'update_time_loss', 'advance_phases': 'phase_mirror',
+                     'execute_net_decision': 'net_advance', 'apply_outputs': 'phase_control', 'get_score': 'get_score'}
+
+
+def timed_method(section, method):
+    def wrapper(self, *args, **kwargs):
+        return self.profiler.call(section, method, self, *args, **kwargs)
+
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def get_profiled_class(cls):
+    """
+    Returns the subclass of an Evaluator class whose profiled_sections methods are timed by each instance's own
+    profiler. It is made once per class, and holds no reference to any instance.
+    """
+    methods = dict((name, timed_method(section, getattr(cls, name))) for name, section in profiled_sections.items())
+    return type('Profiled' + cls.__name__, (cls,), dict(methods, profiled=True, __module__=cls.__module__))
 
 
 class Direction(Enum):
@@ -15,18 +50,18 @@ class Direction(Enum):
     EW = 1
 
 
-def get_yellow_time_for_lane(lane_id):  # Not using this, default yellow time is 4s
-    vmax = traci.lane.getMaxSpeed(lane_id)
+def get_yellow_time_for_lane(lane_id, index=None):  # Not using this, default yellow time is 4s
+    vmax = traci.lane.getMaxSpeed(lane_id) if index is None else index.lanes[lane_id]['speed']
     max_decel = 3.048  # max comfortable deceleration is 10ft/s^2 by ITE standards
     return vmax / (2 * max_decel)  # yellow time formula
 
 
-def set_tls_NS(tlsID):
-    traci.trafficlight.setPhase(tlsID, 0)
+def set_tls_NS(tlsID, conn=traci):
+    conn.trafficlight.setPhase(tlsID, 0)
 
 
-def set_tls_EW(tlsID):
-    traci.trafficlight.setPhase(tlsID, 2)
+def set_tls_EW(tlsID, conn=traci):
+    conn.trafficlight.setPhase(tlsID, 2)
 
 
 def get_stat_filename(xmlfile):
@@ -35,65 +70,388 @@ def get_stat_filename(xmlfile):
     return root.find('output').find('tripinfo-output').get('value')
 
 
+def get_tls_durations(sumo_cmd):
+    """
+    Reads the fixed-time programs sumo will run from the net and additional files of a command, returning the phase
+    durations of each light in simulation steps. Later files override earlier ones, as they do when sumo loads them.
+    """
+    return topology.get_topology(sumo_cmd).get_durations(t_step)
+
+
+def get_demand_model(sumo_cmd):
+    """
+    Builds the demand model for a command's net, with the weight files found beside its sumocfg.
+    """
+    config_file = sumo_cmd[sumo_cmd.index('-c') + 1]
+    config_dir, options = get_input_files(sumo_cmd)
+    return DemandModel(os.path.join(config_dir, options['net-file']),
+                       os.path.join(os.path.dirname(config_file), demand_weights))
+
+
+def get_seed(cmd):
+    return int(cmd[cmd.index('--seed') + 1]) if '--seed' in cmd else 0
+
+
+def get_rng_counts(state_file):
+    """
+    Reads the random number generator call counts that sumo writes into a saved state.
+    """
+    rng_state = ET.parse(state_file).getroot().find('rngState')
+    counts = {}
+    if rng_state is None:
+        return counts
+
+    for element in rng_state.iter():
+        for name, value in element.attrib.items():
+            if name != 'index':
+                counts[(element.tag, element.get('index'), name)] = int(value)
+
+    return counts
+
+
+def rebase_rng_state(state_file, base_counts):
+    """
+    Subtracts the counts present straight after a load from a saved state. Sumo reseeds its generators on a load but
+    does not always reset their counters (the route handler keeps counting across loads), so without this a restore
+    would skip too far ahead in the random stream.
+    """
+    tree = ET.parse(state_file)
+    rng_state = tree.getroot().find('rngState')
+    if rng_state is None:
+        return
+
+    for element in rng_state.iter():
+        for name, value in element.attrib.items():
+            base = base_counts.get((element.tag, element.get('index'), name), 0)
+            if name != 'index' and base:
+                element.set(name, str(int(value) - base))
+
+    tree.write(state_file, encoding='UTF-8', xml_declaration=True)
+
+
 class Evaluator:
     """
     Class for determining the fitness of NEAT genomes for a given traffic scenario.
     """
 
-    def __init__(self, sumo_cmd, tlights=None, loops=None, runtime=total_steps):
+    profiled = False  # set on the subclasses made by get_profiled_class, see create
+
+    @classmethod
+    def create(cls, *args, profile=profile_evaluator, **kwargs):
+        """
+        Makes an Evaluator, of the profiled subclass if profile is set, so that take_profile reports its hot path.
+        """
+        if profile:
+            cls = get_profiled_class(cls)
+        return cls(*args, **kwargs)
+
+    def __init__(self, sumo_cmd, tlights=None, loops=None, runtime=total_steps, label=None,
+                 control_period=control_period, backend=None, generated_demand=use_generated_demand):
         # self.stat_filename = get_stat_filename(sumo_cmd[2])
         self.cmd = sumo_cmd
 
         # ==== Start sumo server and obtain rest of variables ==== #
-        traci.start(sumo_cmd)
+        # backend is 'libsumo', 'traci', 'fastest' or a backend object, a label lets one process drive several sumo
+        # instances over traci
+        self.backend = backends.get_backend(backend, label)
+        self.conn = self.backend.start(sumo_cmd)
+
+        self.profiler = None
+        if self.profiled:  # opt-in through create, only the profiled subclass wraps the methods in timers
+            self.profiler = Profiler()
+            self.conn = self.profiler.wrap_connection(self.conn)
+
+        # lights, loops and their layout come from the scenario's files (see topology.py) rather than from sumo
+        self.topology = topology.get_topology(sumo_cmd)
 
         if tlights is not None:
             self.tlight_IDs = tlights
         else:
-            self.tlight_IDs = traci.trafficlight.getIDList()
+            self.tlight_IDs = self.topology.tls_ids
 
         if loops is not None:
             self.loop_IDs = loops
         else:
-            self.loop_IDs = traci.inductionloop.getIDList()
+            self.loop_IDs = self.topology.loop_ids
 
         self.runtime = runtime
+        self.control_period = control_period  # simulation steps per net decision
+
+        self.time_loss = TimeLossAggregator()
 
-        self.time_loss = {}
+        self.num_loops = len(self.topology.loop_ids)
 
         self.locks = {}
 
         for k in self.tlight_IDs:
             self.locks[k] = 0
 
+        self.start_step = 0
+        self.running = 0
+        self.truncated = False
+        self.trace = None  # the Trace net decisions are recorded to, see record
+
+        # the phase of every light is tracked locally from its program instead of being read back each step
+        self.durations = self.topology.get_durations(t_step)
+        missing = [tlsID for tlsID in self.tlight_IDs if tlsID not in self.durations]
+        if missing:
+            raise ValueError("No fixed-time program to mirror for traffic lights {0}.".format(missing))
+        self.phases = {}
+        self.remaining = {}
+
+        # with generated demand each run starts from the scenario without its route files and the trips for its seed
+        # are added over traci
+        self.demand = get_demand_model(sumo_cmd) if generated_demand else None
+
+        self.snapshots = {}
+        if use_snapshots:  # keep saved states in memory where possible
+            self.snapshot_dir = tempfile.mkdtemp(prefix='traci-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+        self.subscribe()
+
     def __del__(self):
-        traci.close()
+        self.backend.close(self.conn)
+
+        if use_snapshots:
+            shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+    def take_profile(self):
+        """
+        Returns the profile of everything run since the last call, or None if profiling is off.
+        """
+        if self.profiler is None:
+            return None
+        return self.profiler.take()
 
     def reset(self, cmd=None):
         if cmd is None:
             cmd = self.cmd
 
-        self.time_loss = {}
+        if use_snapshots:
+            self.restore_snapshot(cmd)
+            return
+
+        self.time_loss = TimeLossAggregator()
 
         for k in self.tlight_IDs:
             self.locks[k] = 0
 
-        traci.load(cmd[1:])
-
-    def do_timestep(self):
-        traci.simulationStep()
-        self.update_time_loss()
+        self.load(cmd)
+        self.add_demand(cmd)
+        self.subscribe()  # subscriptions do not survive a reload
+        self.warm_up(0)
+
+    def warm_up(self, step):
+        """
+        Simulates the rest of the warm-up from step on under the default timings, after which the controller takes
+        over.
+        """
+        for _ in range(step, int(warmup_time / t_step)):
+            self.do_timestep()
 
+        self.start_step = int(warmup_time / t_step)
+
+    def load(self, cmd, options=()):
+        """
+        Reloads sumo with a command and the extra options given, leaving out its route files if the demand is
+        generated.
+        """
+        if self.demand is not None:
+            options = list(options) + ['--route-files', '']
+        self.conn.load(cmd[1:] + list(options))
+
+    def add_demand(self, cmd, begin=0, end=None):
+        """
+        Adds the generated trips for the seed of a command that depart between begin and end (in seconds), if demand
+        is generated.
+        """
+        if self.demand is not None:
+            self.demand.inject(self.conn, get_seed(cmd), begin, end)
+
+    def get_snapshot_step(self):
+        """
+        Returns the step the warm-up state is saved at, a whole interval of the loops before the end of the warm-up.
+        loadState does not bring back what the loops have aggregated, so the rest of the warm-up is simulated after
+        every restore to fill their current interval. After a loadState sumo starts the loops' intervals one step
+        later, so the state is saved a step before an interval boundary to keep them on the same boundaries as in a
+        run from the start.
+        """
+        warmup_steps = int(warmup_time / t_step)
+        period = max([self.topology.loops[loopID]['period'] for loopID in self.loop_IDs] + [t_step])
+        period_steps = int(round(period / t_step))  # the longest period is a multiple of the others in practice
+        return max(0, (warmup_steps - period_steps) // period_steps * period_steps - 1)
+
+    def restore_snapshot(self, cmd):
+        """
+        Brings the simulation to the end of the warm-up period for the given command. The first time a command
+        (scenario and seed) is seen the warm-up is simulated up to the snapshot step and saved. The saved state is then
+        restored along with the evaluator's own bookkeeping, straight after saving it as well, so that every run with
+        snapshots starts from the same state. The rest of the warm-up is simulated from there.
+
+        This is approximate: a restored run can drift from one that simulates its whole warm-up (see test_snapshots),
+        as sumo does not save everything a run carries from one step to the next. The time each light has spent in
+        its phase and the lane changes vehicles have lined up are lost, and neither can be set over traci.
+        """
+        key = (tuple(cmd[1:]), warmup_time)
+        snapshot_step = self.get_snapshot_step()
+
+        if key not in self.snapshots:
+            self.time_loss = TimeLossAggregator()
+
+            for k in self.tlight_IDs:
+                self.locks[k] = 0
+
+            self.load(cmd, snapshot_options)
+
+            path = os.path.join(self.snapshot_dir, '{0}.xml'.format(len(self.snapshots)))
+            self.conn.simulation.saveState(path)  # counters left over from earlier loads
+            base_counts = get_rng_counts(path)
+
+            # vehicles waiting to depart do not keep their insertion order through a saved state, so only the ones
+            # departing before it is saved go in first (and after the counters are read, as adding a vehicle draws
+            # from the generators)
+            self.add_demand(cmd, end=snapshot_step * t_step)
+            self.subscribe()
+
+            for _ in range(snapshot_step):
+                self.do_timestep()
+
+            self.conn.simulation.saveState(path)
+            rebase_rng_state(path, base_counts)
+            self.snapshots[key] = (path, self.time_loss.copy(), dict(self.locks))
+
+        path, time_loss, locks = self.snapshots[key]
+
+        # sumo only reseeds its random number generators on a load, so the command is reloaded without its routes (the
+        # demand is part of the saved state) before the state itself is restored
+        self.conn.load(cmd[1:] + snapshot_options + ['--route-files', ''])
+        self.conn.simulation.loadState(path)
+        self.add_demand(cmd, begin=snapshot_step * t_step)
+
+        self.time_loss = time_loss.copy()
+        self.locks = dict(locks)
+
+        self.subscribe()
+        for veh_id in self.conn.vehicle.getIDList():  # vehicles restored from the state never show up as departed
+            self.conn.vehicle.subscribe(veh_id, [traci.constants.VAR_TIMELOSS])
+
+        self.warm_up(snapshot_step)
+
+    def subscribe(self):
+        """
+        Subscribes to every loop, light and simulation variable read on the hot path, so that a single
+        simulationStep delivers all of them in one batch.
+        """
+        for loopID in self.loop_IDs:
+            self.conn.inductionloop.subscribe(loopID, [traci.constants.VAR_INTERVAL_OCCUPANCY])
+
+        if verify_phases:
+            for tlsID in self.tlight_IDs:
+                self.conn.trafficlight.subscribe(tlsID, [traci.constants.TL_CURRENT_PHASE])
+
+        self.conn.simulation.subscribe([traci.constants.VAR_DEPARTED_VEHICLES_IDS,
+                                        traci.constants.VAR_ARRIVED_VEHICLES_IDS,
+                                        traci.constants.VAR_MIN_EXPECTED_VEHICLES])
+
+        self.poll_subscriptions()
+        self.running = self.conn.vehicle.getIDCount()  # vehicles already on the road (e.g. from a snapshot)
+        self.sync_phases()
+
+    def sync_phases(self):
+        """
+        Reads the phase of every light and the steps left in it back from sumo, once per (re)load.
+        """
+        now = self.conn.simulation.getTime()
+        for tlsID in self.tlight_IDs:
+            self.phases[tlsID] = self.conn.trafficlight.getPhase(tlsID)
+            self.remaining[tlsID] = int(round((self.conn.trafficlight.getNextSwitch(tlsID) - now) / t_step))
+
+    def advance_phases(self):
+        """
+        Steps the local copy of every light's program. Sumo holds a phase through the step that reaches its switch
+        time and moves on during the next one. With verify_phases set the copy is checked against sumo each step.
+        """
+        for tlsID in self.tlight_IDs:
+            if self.remaining[tlsID] == 0:
+                durations = self.durations[tlsID]
+                self.phases[tlsID] = (self.phases[tlsID] + 1) % len(durations)
+                self.remaining[tlsID] = durations[self.phases[tlsID]]
+            self.remaining[tlsID] -= 1
+
+        if verify_phases:
+            phases = self.conn.trafficlight.getAllSubscriptionResults()
+            for tlsID in self.tlight_IDs:
+                phase = phases[tlsID][traci.constants.TL_CURRENT_PHASE]
+                if phase != self.phases[tlsID]:
+                    raise RuntimeError("Mirrored phase {0} of {1} differs from sumo's phase {2} at {3}s.".format(
+                        self.phases[tlsID], tlsID, phase, self.conn.simulation.getTime()))
+
+    def set_phase(self, tlsID, direction):
+        """
+        Starts the green phase for the given direction (through its yellow) on a light and on its local copy.
+        """
+        if direction == Direction.NS:
+            set_tls_NS(tlsID, self.conn)
+            self.phases[tlsID] = 0
+        else:
+            set_tls_EW(tlsID, self.conn)
+            self.phases[tlsID] = 2
+
+        self.remaining[tlsID] = self.durations[tlsID][self.phases[tlsID]]
+        self.locks[tlsID] = 0
+
+    def poll_subscriptions(self):
+        """
+        Copies the latest subscription results into the evaluator. Call once after every simulationStep.
+        """
+        occupancy = self.conn.inductionloop.getAllSubscriptionResults()
+        self.inputs = [occupancy[loopID][traci.constants.VAR_INTERVAL_OCCUPANCY] for loopID in self.loop_IDs]
+
+        sim = self.conn.simulation.getSubscriptionResults()
+        self.departed = sim[traci.constants.VAR_DEPARTED_VEHICLES_IDS]
+        self.arrived = sim[traci.constants.VAR_ARRIVED_VEHICLES_IDS]
+        self.min_expected = sim[traci.constants.VAR_MIN_EXPECTED_VEHICLES]
+        self.running += len(self.departed) - len(self.arrived)
+
+    def do_timestep(self, steps=1):
+        """
+        Advances the simulation by the given number of steps, applying the time limit to each light after every one
+        of them, so the baseline behaves the same whatever the control period. Afterwards get_inputs returns the
+        detector occupancies averaged over the steps simulated.
+        """
+        if steps == 1:
+            self.conn.simulationStep()
+            self.poll_subscriptions()
+            self.advance_phases()
+            self.update_time_loss()
+            self.apply_time_limit()
+        else:
+            totals = [0 for _ in self.loop_IDs]
+            for k in range(steps):
+                self.conn.simulationStep()
+                self.poll_subscriptions()
+                self.advance_phases()
+                self.update_time_loss()
+                self.apply_time_limit()
+                totals = [a + b for a, b in zip(totals, self.inputs)]
+
+                if self.min_expected == 0:  # nothing left to simulate
+                    break
+
+            self.inputs = [a / (k + 1) for a in totals]
+
+    def apply_time_limit(self):
+        """
+        Switches every light whose green has been held for limit_time steps and counts a step for the others.
+        """
         for tlsID in self.tlight_IDs:
             if self.locks[tlsID] >= limit_time:
-                cur_phase = traci.trafficlight.getPhase(tlsID)
+                cur_phase = self.phases[tlsID]
 
                 if cur_phase == 1:  # change phase if over time limit
-                    set_tls_EW(tlsID)
-                    self.locks[tlsID] = 0
+                    self.set_phase(tlsID, Direction.EW)
                 elif cur_phase == 3:
-                    set_tls_NS(tlsID)
-                    self.locks[tlsID] = 0
+                    self.set_phase(tlsID, Direction.NS)
             else:
                 self.locks[tlsID] += 1
 
@@ -103,99 +461,195 @@ class Evaluator:
         else:
             self.reset(cmd=cmd)
 
-        step = 0
+        step = self.start_step
 
         while step < self.runtime:
-            self.do_timestep()
-            step += 1
+            steps = min(self.control_period, self.runtime - step)
+            self.do_timestep(steps)
+            step += steps
 
-            if traci.simulation.getMinExpectedNumber() == 0:
+            if self.min_expected == 0:
                 break
 
-        num_remaining = traci.vehicle.getIDCount()  # penalise leaving vehicles stranded
+        return self.get_score()
+
+    def get_score_bound(self):
+        """
+        Returns the best score this run can still finish with, or None while more vehicles may depart. Once demand is
+        exhausted the set of vehicles is fixed and their time losses can only grow, so the current average time loss
+        (with no stranding penalty) is a bound on the final score.
+        """
+        if self.min_expected != self.running or not self.time_loss:
+            return None
+
+        return -1 * self.time_loss.mean()
+
+    def get_metrics(self):
+        """
+        Returns the time loss statistics and vehicle counts of the run that just finished.
+        """
+        return {'mean_time_loss': self.time_loss.mean(), 'median_time_loss': self.time_loss.quantile(0.5),
+                'p95_time_loss': self.time_loss.quantile(0.95), 'max_time_loss': self.time_loss.max(),
+                'vehicles': len(self.time_loss), 'stranded': self.conn.vehicle.getIDCount()}
+
+    def get_score(self):
+        num_remaining = self.conn.vehicle.getIDCount()  # penalise leaving vehicles stranded
         return -1 * (self.get_average_time_loss_fast() + 50 * num_remaining)
 
-    def execute_net_decision(self, net: neat.nn, inputs):
-        if len(inputs) != traci.inductionloop.getIDCount():
+    def execute_net_decision(self, net: neat.nn, inputs, advance_time=t_step):
+        if len(inputs) != self.num_loops:
             raise ValueError("Number of network inputs must match the number of induction loops.")
 
-        if type(net) == neat.ctrnn.CTRNN:  # Continuous Time Recurrent NN (CTRNN) has slightly different implementation
-            outputs = net.advance(inputs, t_step, t_step)
+        if type(net) in (neat.ctrnn.CTRNN, CompiledCTRNN):  # CTRNNs have a slightly different implementation
+            outputs = net.advance(inputs, advance_time, t_step)
         else:
             outputs = net.activate(inputs)
 
+        self.apply_outputs(outputs)
+
+    def apply_outputs(self, outputs):
+        """
+        Switches the lights the network asks for, subject to the lock and mid-change rules.
+        """
         if len(outputs) != 2 * len(self.tlight_IDs):  # two output nodes per intersection
             raise ValueError("Number of network outputs must match the number of traffic lights under network control.")
 
-        for i, tlsID in enumerate(self.tlight_IDs):
-            cur_phase = traci.trafficlight.getPhase(tlsID)
-            choice = Direction(argmax(outputs[i * 2: i * 2 + 2]))
+        choices = [Direction(argmax(outputs[i * 2: i * 2 + 2])) for i in range(len(self.tlight_IDs))]
+        switched = self.apply_choices(choices)
+
+        if self.trace is not None:
+            self.trace.append(self.inputs, [choice.value for choice in choices], switched)
+
+    def apply_choices(self, choices):
+        """
+        Switches each light towards the direction chosen for it, unless it is locked or mid-change. Returns whether
+        each light was switched.
+        """
+        switched = []
+        for tlsID, choice in zip(self.tlight_IDs, choices):
+            cur_phase = self.phases[tlsID]
 
             if self.locks[tlsID] <= int(lock_time / t_step):  # implement time lock on recently changed signals
+                switched.append(False)
                 continue
 
             if cur_phase == 0 or cur_phase == 2:  # traffic lights that are mid-change are locked
+                switched.append(False)
                 continue
 
-            if choice == Direction.NS and cur_phase != 1:  # no need to change if already that state
-                set_tls_NS(tlsID)
-                self.locks[tlsID] = 0
-            elif choice == Direction.EW and cur_phase != 3:
-                set_tls_EW(tlsID)
-                self.locks[tlsID] = 0
+            if (choice == Direction.NS and cur_phase != 1) or (choice == Direction.EW and cur_phase != 3):
+                self.set_phase(tlsID, choice)  # no need to change if already that state
+                switched.append(True)
+            else:
+                switched.append(False)
 
-    def get_inputs(self):  # Should change to subscription-based polling
-        return [traci.inductionloop.getIntervalOccupancy(loopID) for loopID in self.loop_IDs]
+        return switched
+
+    def get_inputs(self):  # filled from the loop subscriptions in poll_subscriptions
+        return self.inputs
 
     def update_time_loss(self):
+        """
+        Subscribes newly departed vehicles and hands the running vehicles' subscription results to the aggregator,
+        which folds in the vehicles that arrived this step and reads the others' time losses only when they are needed.
+        """
         constant = traci.constants.VAR_TIMELOSS
-        for veh_id in traci.simulation.getDepartedIDList():
-            traci.vehicle.subscribe(veh_id, [constant])
+        for veh_id in self.departed:
+            self.conn.vehicle.subscribe(veh_id, [constant])
 
-        for key, value in traci.vehicle.getAllSubscriptionResults().items():
-            self.time_loss[key] = value[constant]
+        # traci clears its results dict on every step, the aggregator needs this step's until the next
+        self.time_loss.update(dict(self.conn.vehicle.getAllSubscriptionResults()), self.arrived, constant)
 
     def get_average_time_loss_fast(self):
-        total_time_loss = 0
-        num_vehicles = len(self.time_loss)
-        for key, value in self.time_loss.items():
-            total_time_loss += value
-
-        if num_vehicles == 0:
-            return 0
-        else:
-            return total_time_loss / num_vehicles
+        return self.time_loss.mean()
 
     def get_median_time_loss_fast(self):
-        num_vehicles = len(self.time_loss)
-        time_losses = []
-        for key, value in self.time_loss.items():
-            time_losses.append(value)
+        return self.time_loss.quantile(0.5)
 
-        if num_vehicles == 0:
-            return 0
-        else:
-            return time_losses[num_vehicles // 2]
+    def get_time_loss_quantile(self, q):  # within the sketch's relative accuracy (1% by default)
+        return self.time_loss.quantile(q)
 
     def get_max_time_loss(self):
-        return max(self.time_loss.values())
-
-    def get_net_fitness(self, net: neat.nn, cmd=None):
+        return self.time_loss.max()
+
+    def get_net_fitness(self, net: neat.nn, cmd=None, cutoff=None):
+        """
+        Runs the net in control of the lights and returns its score. If a cutoff is given the run stops as soon as
+        its score is certain to end up below it, returning the bound from get_score_bound instead (which is never
+        worse than the score a full run would give) and setting self.truncated.
+        """
         if cmd is None:
             self.reset()
         else:
             self.reset(cmd=cmd)
 
-        step = 0
+        step = self.start_step
         net.reset()
+        self.truncated = False
 
-        while step < self.runtime:
-            self.do_timestep()
-            self.execute_net_decision(net, self.get_inputs())
-            step += 1
+        while step < self.runtime:  # the net is queried once per control period, stepping the ctrnn at t_step
+            steps = min(self.control_period, self.runtime - step)
+            self.do_timestep(steps)
+            self.execute_net_decision(net, self.get_inputs(), steps * t_step)
+            step += steps
 
-            if traci.simulation.getMinExpectedNumber() == 0:
+            if self.min_expected == 0:
                 break
 
-        num_remaining = traci.vehicle.getIDCount()  # penalise leaving vehicles stranded
-        return -1 * (self.get_average_time_loss_fast() + 50 * num_remaining)
+            if cutoff is not None:
+                bound = self.get_score_bound()
+                if bound is not None and bound < cutoff:
+                    self.truncated = True
+                    return bound
+
+        return self.get_score()
+
+    def record(self, net: neat.nn, cmd=None):
+        """
+        Runs the net as get_net_fitness does (without a cutoff) and returns a recording.Trace of its decisions, with
+        the score it got.
+        """
+        if cmd is None:
+            cmd = self.cmd
+
+        self.trace = Trace(cmd, self.runtime, self.control_period, self.tlight_IDs, self.loop_IDs)
+        try:
+            self.trace.fitness = self.get_net_fitness(net, cmd=cmd)
+            return self.trace
+        finally:
+            self.trace = None
+
+    def replay(self, trace, cmd=None):
+        """
+        Drives the lights from a recorded trace alone, with no net in the loop, and returns the score. The run is
+        checked against the trace at every decision, so a replay that returns reproduced the recording. The command
+        defaults to the recorded one, run with this evaluator's sumo binary (so sumo-gui can watch a headless
+        recording).
+        """
+        if trace.tls_ids != list(self.tlight_IDs) or trace.loop_ids != list(self.loop_IDs):
+            raise ValueError("The trace was recorded on other traffic lights or induction loops.")
+
+        self.reset(cmd=trace.cmd if cmd is None else cmd)
+
+        step = self.start_step
+        k = 0
+        while step < trace.runtime:  # the same steps as get_net_fitness, taking each decision from the trace
+            steps = min(trace.control_period, trace.runtime - step)
+            self.do_timestep(steps)
+            if k >= len(trace):
+                raise RuntimeError("The replay ran past the {0} recorded decisions.".format(len(trace)))
+            switched = self.apply_choices([Direction(choice) for choice in trace.choices[k]])
+            trace.check(k, self.inputs, switched)
+            step += steps
+            k += 1
+
+            if self.min_expected == 0:
+                break
+
+        if k != len(trace):
+            raise RuntimeError("The replay ended after {0} of the {1} recorded decisions.".format(k, len(trace)))
+
+        return self.get_score()
+
+
+ProfiledEvaluator = get_profiled_class(Evaluator)  # module-level so profiled evaluators can be pickled by name
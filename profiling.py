@@ -0,0 +1,131 @@
+import time
+
+# subscription getters only read results that came back with the last simulationStep, so they cost no round trip
+local_calls = {'getAllSubscriptionResults', 'getSubscriptionResults', 'getAllContextSubscriptionResults',
+               'getContextSubscriptionResults'}
+
+
+class Profile:
+    """
+    Time spent in and calls made to each profiled section over some number of runs. Sections named traci.* are calls
+    into sumo, every one of which is a round trip when running over traci. Times are exclusive: a section's time does
+    not include the sections it called.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.calls = {}
+
+    def add(self, name, seconds, calls=1):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def merge(self, other):
+        for name in other.times:
+            self.add(name, other.times[name], other.calls[name])
+
+    def runs(self):  # every run starts with a reset
+        return self.calls.get('reset', 0)
+
+    def steps(self):
+        return self.calls.get('traci.simulationStep', 0)
+
+    def round_trips(self):
+        return sum(n for name, n in self.calls.items() if name.startswith('traci.'))
+
+    def report(self, title='Evaluator profile'):
+        """
+        Returns a table of each section's share of the time, its time per simulation step and calls per step.
+        """
+        total = sum(self.times.values())
+        steps = max(self.steps(), 1)
+        lines = ["{0}: {1} runs, {2} steps, {3:.2f}s, {4:.1f} traci round trips per step".format(
+            title, self.runs(), self.steps(), total, self.round_trips() / steps)]
+
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append("  {0:<36} {1:6.1f}% {2:9.1f} us/step {3:8.2f} calls/step".format(
+                name, 100 * self.times[name] / total if total else 0, 1e6 * self.times[name] / steps,
+                self.calls[name] / steps))
+
+        return '\n'.join(lines)
+
+
+class Profiler:
+    """
+    Collects a Profile by wrapping functions and a sumo connection in timers. Nothing is wrapped unless profiling is
+    on, so code that is not profiled runs untouched.
+    """
+
+    def __init__(self):
+        self.profile = Profile()
+        self.stack = []  # time spent in profiled calls made by each open section
+
+    def call(self, name, func, *args, **kwargs):
+        """
+        Calls func, adding the time it took (less that of the profiled calls it made) to section name.
+        """
+        stack = self.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.profile.add(name, elapsed - stack.pop())
+            if stack:
+                stack[-1] += elapsed
+
+    def timed(self, name, func):
+        def wrapper(*args, **kwargs):
+            return self.call(name, func, *args, **kwargs)
+
+        return wrapper
+
+    def wrap_connection(self, conn):
+        return ConnectionProxy(conn, self)
+
+    def take(self):
+        """
+        Returns the profile of everything run since the last call and starts a new one.
+        """
+        profile = self.profile
+        self.profile = Profile()
+        return profile
+
+
+class ConnectionProxy:
+    """
+    Stands in for a traci connection (or the libsumo module), timing and counting every call made through it.
+    """
+
+    def __init__(self, target, profiler, prefix='traci'):
+        self._target = target
+        self._profiler = profiler
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name in local_calls or name.startswith('_') or isinstance(attr, (int, float, str, tuple)):
+            return attr
+
+        if callable(attr) and not isinstance(attr, type):
+            wrapped = self._profiler.timed('{0}.{1}'.format(self._prefix, name), attr)
+        else:  # a domain such as vehicle or trafficlight
+            wrapped = ConnectionProxy(attr, self._profiler, '{0}.{1}'.format(self._prefix, name))
+
+        setattr(self, name, wrapped)  # later lookups skip __getattr__
+        return wrapped
+
+
+def merge_worker_profiles(profiles):
+    """
+    Merges a dict of worker id -> Profile into a single Profile, and returns it with a line per worker showing how
+    its load compares to the others.
+    """
+    total = Profile()
+    lines = []
+    for worker, profile in sorted(profiles.items()):
+        total.merge(profile)
+        lines.append("  worker {0}: {1} runs, {2:.2f}s".format(worker, profile.runs(), sum(profile.times.values())))
+
+    return total, '\n'.join(lines)
@@ -0,0 +1,81 @@
+import json
+import numpy as np
+
+
+class Trace:
+    """
+    What a net did in one run: at every decision, the loop occupancies it was given (as float32), the direction it
+    chose for each light and whether that switched the light. Together with the command and runtime of the run this is
+    enough to drive the lights again without the net (Evaluator.replay), and to check that the simulation is still the
+    one recorded. Saved as a compressed npz, a run of the cbd scenario takes a few tens of kilobytes.
+    """
+
+    def __init__(self, cmd, runtime, control_period, tls_ids, loop_ids):
+        self.cmd = list(cmd)
+        self.runtime = runtime
+        self.control_period = control_period
+        self.tls_ids = list(tls_ids)
+        self.loop_ids = list(loop_ids)
+        self.fitness = None  # set once the recorded run finishes
+
+        self.inputs = []
+        self.choices = []
+        self.switched = []
+
+    def __len__(self):
+        return len(self.choices)
+
+    def append(self, inputs, choices, switched):
+        self.inputs.append(np.array(inputs, dtype=np.float32))
+        self.choices.append(choices)
+        self.switched.append(switched)
+
+    def check(self, k, inputs, switched):
+        """
+        Raises RuntimeError if the inputs or switches at decision k of a replay differ from the recorded ones.
+        """
+        live = np.array(inputs, dtype=np.float32)
+        if not np.array_equal(live, self.inputs[k]):
+            i = int(np.flatnonzero(live != self.inputs[k])[0])
+            raise RuntimeError("The replay diverged from the trace at decision {0}: loop {1} reads {2}, recorded {3}."
+                               .format(k, self.loop_ids[i], live[i], self.inputs[k][i]))
+
+        if list(switched) != list(self.switched[k]):
+            raise RuntimeError("The replay switched lights {0} at decision {1}, the trace switched {2}.".format(
+                [tlsID for tlsID, s in zip(self.tls_ids, switched) if s], k,
+                [tlsID for tlsID, s in zip(self.tls_ids, self.switched[k]) if s]))
+
+    def get_switches(self):
+        """
+        Returns tls id -> [(decision, direction value)] for every switch the net made, for a quick look at a run.
+        """
+        switches = dict((tlsID, []) for tlsID in self.tls_ids)
+        for k, (choices, switched) in enumerate(zip(self.choices, self.switched)):
+            for tlsID, choice, s in zip(self.tls_ids, choices, switched):
+                if s:
+                    switches[tlsID].append((k, choice))
+
+        return switches
+
+    def save(self, path):
+        header = {'cmd': self.cmd, 'runtime': self.runtime, 'control_period': self.control_period,
+                  'tls_ids': self.tls_ids, 'loop_ids': self.loop_ids, 'fitness': self.fitness}
+        shape = (len(self), len(self.tls_ids))
+        with open(path, 'wb') as f:  # a file object keeps numpy from appending .npz to the name
+            np.savez_compressed(f, header=np.array(json.dumps(header)),
+                                inputs=np.array(self.inputs, dtype=np.float32).reshape(len(self), len(self.loop_ids)),
+                                choices=np.array(self.choices, dtype=np.uint8).reshape(shape),
+                                switched=np.array(self.switched, dtype=bool).reshape(shape))
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            header = json.loads(str(data['header']))
+            trace = Trace(header['cmd'], header['runtime'], header['control_period'], header['tls_ids'],
+                          header['loop_ids'])
+            trace.fitness = header['fitness']
+            trace.inputs = list(data['inputs'])
+            trace.choices = data['choices'].tolist()
+            trace.switched = data['switched'].tolist()
+
+        return trace
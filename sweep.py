@@ -0,0 +1,127 @@
+import csv
+import math
+import os
+import threading
+import workers
+
+columns = ['seed', 'score', 'mean_time_loss', 'median_time_loss', 'p95_time_loss', 'max_time_loss', 'vehicles',
+           'stranded']
+
+
+class RunningStats:
+    """
+    Count, mean and sample standard deviation of a stream of values, updated one value at a time (Welford).
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+
+class StatsSweep:
+    """
+    Scores a genome (or the baseline if genome is None) over a range of seeds on the worker pool, appending a csv row
+    of the score and time loss metrics for each run to path as soon as it finishes. Seeds already in the file are
+    skipped, so an interrupted sweep picks up where it stopped. Scores are positive (lower is better), as in the
+    stats files under data/.
+
+    The running mean and standard deviation can be read from another thread with summary() while run() is going.
+    """
+
+    def __init__(self, path, genome=None, config=None, seeds=range(100)):
+        if genome is not None and config is None:
+            raise ValueError("You need to provide a config if evaluating genomes")
+
+        self.path = path
+        self.genome = genome
+        self.config = config
+        self.seeds = list(seeds)
+
+        self.stats = RunningStats()
+        self.lock = threading.Lock()
+        self.done = set()
+
+    def load(self):
+        """
+        Reads the rows already on disk into the running stats, dropping a last row cut short by a crash. Raises
+        ValueError for a file without the sweep's header, such as the older headerless stats files, rather than
+        appending to it.
+        """
+        self.stats = RunningStats()
+        self.done = set()
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, newline='') as f:  # checked before anything is cut off the file
+            header = next(csv.reader(f), None)
+        if header is not None and not {'seed', 'score'} <= set(header):
+            raise ValueError("{0} has no seed and score columns, so it was not written by a sweep. Give the sweep a "
+                             "new path.".format(self.path))
+
+        with open(self.path, 'rb+') as f:  # a partial last line would be read as a short row, so cut it off
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+        with open(self.path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.done.add(int(row['seed']))
+                self.stats.add(float(row['score']))
+
+    def run(self, num=None, report_every=50):
+        """
+        Runs every seed not yet recorded, printing the running stats every report_every rows. Returns summary().
+        """
+        self.load()
+        todo = [seed for seed in self.seeds if seed not in self.done]
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(columns)
+                f.flush()
+
+            def record(i, fitness, metrics):
+                metrics = metrics or {}
+                writer.writerow([todo[i], -1 * fitness] + [metrics.get(name, '') for name in columns[2:]])
+                f.flush()
+
+                with self.lock:
+                    self.done.add(todo[i])
+                    self.stats.add(-1 * fitness)
+                    if report_every and self.stats.n % report_every == 0:
+                        print("{0} of {1} seeds: mean {2:.3f}, stdev {3:.3f}".format(
+                            len(self.done), len(self.seeds), self.stats.mean, self.stats.stdev))
+
+            pool = workers.get_pool(num)
+            fitnesses = pool.evaluate([(self.genome, seed) for seed in todo], self.config,
+                                      on_result=lambda i, fitness, truncated, metrics: record(i, fitness, metrics))
+
+            for i, fitness in enumerate(fitnesses):  # cached results never pass through on_result
+                if todo[i] not in self.done:
+                    record(i, fitness, None)
+
+        return self.summary()
+
+    def summary(self):
+        """
+        Returns (runs recorded, mean score, stdev of the score) so far.
+        """
+        with self.lock:
+            return self.stats.n, self.stats.mean, self.stats.stdev
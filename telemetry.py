@@ -0,0 +1,168 @@
+import json
+import os
+import pickle
+import statistics
+import sys
+import time
+import visualize
+from neat.math_util import mean, stdev
+from neat.reporting import BaseReporter
+
+
+def get_genomes_path(path):
+    return os.path.splitext(path)[0] + '.genomes'
+
+
+class TelemetryReporter(BaseReporter):
+    """
+    Logs training as it goes instead of holding it in memory like neat's StatisticsReporter. After every evaluation
+    a json line is appended to the log at path with the generation's fitness distribution (mean, standard deviation,
+    extremes and deciles), species sizes, timing and a reference to its best genome, which is appended to a pickle
+    file beside the log. Both files are only ever appended to, so a crash loses at most the generation in progress.
+    Read them back with TelemetryLog, which the visualize plots accept in place of a StatisticsReporter.
+    """
+
+    def __init__(self, path, append=False):
+        """
+        append carries on an existing log (when resuming from a checkpoint), otherwise it is started over.
+        """
+        self.path = path
+        self.genomes_path = get_genomes_path(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        for name in (self.path, self.genomes_path):
+            open(name, 'ab' if append else 'wb').close()
+
+        self.generation = None
+        self.start = None
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.start = time.time()
+
+    def post_evaluate(self, config, population, species, best_genome):
+        fitnesses = [genome.fitness for genome in population.values()]
+
+        with open(self.genomes_path, 'ab') as f:
+            offset = f.tell()
+            pickle.dump(best_genome, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        record = {'generation': self.generation, 'time': time.time(), 'seconds': time.time() - self.start,
+                  'fitness': {'mean': mean(fitnesses), 'stdev': stdev(fitnesses), 'min': min(fitnesses),
+                              'max': max(fitnesses),
+                              'deciles': statistics.quantiles(fitnesses, n=10) if len(fitnesses) > 1 else []},
+                  'species': dict((str(sid), len(s.members)) for sid, s in species.species.items()),
+                  'best': {'key': best_genome.key, 'fitness': best_genome.fitness, 'offset': offset}}
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def read(self):
+        return TelemetryLog(self.path)
+
+
+class TelemetryLog:
+    """
+    A telemetry log read back, generation by generation. update picks up the lines written since, so a log can be
+    followed while training is still running. A resumed run logs the generations since its checkpoint again, and
+    only the last record of each generation is kept.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.genomes_path = get_genomes_path(path)
+        self.records = {}
+        self.offset = 0
+        self.update()
+
+    def update(self):
+        """
+        Reads the complete lines appended since the last call and returns how many there were.
+        """
+        if os.path.getsize(self.path) < self.offset:  # the log was started over by a new run
+            self.records = {}
+            self.offset = 0
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+
+        lines = data[:data.rfind(b'\n') + 1]  # a line still being written is left for the next call
+        self.offset += len(lines)
+        for line in lines.splitlines():
+            record = json.loads(line)
+            self.records[record['generation']] = record
+
+        return len(lines.splitlines())
+
+    def get_generations(self):
+        return sorted(self.records)
+
+    def get_fitness_stat(self, name):
+        return [self.records[generation]['fitness'][name] for generation in self.get_generations()]
+
+    def get_fitness_mean(self):
+        return self.get_fitness_stat('mean')
+
+    def get_fitness_stdev(self):
+        return self.get_fitness_stat('stdev')
+
+    def get_fitness_median(self):
+        return [deciles[4] if deciles else maximum
+                for deciles, maximum in zip(self.get_fitness_stat('deciles'), self.get_fitness_stat('max'))]
+
+    def get_best_fitness(self):
+        return [self.records[generation]['best']['fitness'] for generation in self.get_generations()]
+
+    def get_species_sizes(self):
+        """
+        Returns the size of every species (0 when absent) in each generation, as StatisticsReporter does.
+        """
+        sizes = [self.records[generation]['species'] for generation in self.get_generations()]
+        max_species = max([int(sid) for generation in sizes for sid in generation] + [0])
+        return [[generation.get(str(sid), 0) for sid in range(1, max_species + 1)] for generation in sizes]
+
+    def get_best_genome(self, generation):
+        with open(self.genomes_path, 'rb') as f:
+            f.seek(self.records[generation]['best']['offset'])
+            return pickle.load(f)
+
+    def best_unique_genomes(self, n):
+        """
+        Returns the n fittest of the generation bests, with no duplication, as StatisticsReporter does. Only those n
+        are read from disk.
+        """
+        best = {}
+        for generation in self.get_generations():
+            best[self.records[generation]['best']['key']] = generation  # the latest copy, as in StatisticsReporter
+
+        order = sorted(best.values(), key=lambda generation: self.records[generation]['best']['fitness'], reverse=True)
+        return [self.get_best_genome(generation) for generation in order[:n]]
+
+
+def watch(path, prefix, interval=30.0):
+    """
+    Redraws the fitness and speciation plots of a log (to prefix-fitness.svg and prefix-speciation.svg) whenever new
+    generations are logged, until interrupted.
+    """
+    log = None
+    while True:
+        if log is None and os.path.exists(path):
+            log = TelemetryLog(path)
+            new = len(log.records)
+        else:
+            new = log.update() if log is not None else 0
+
+        if new and log.records:
+            visualize.plot_stats(log, ylog=False, view=False, filename=prefix + '-fitness.svg')
+            visualize.plot_species(log, view=False, filename=prefix + '-speciation.svg')
+            print("Plotted {0} generations of {1}".format(len(log.records), path))
+
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    # python telemetry.py LOG [PREFIX] keeps the plots of a training log up to date while it runs
+    if len(sys.argv) < 2:
+        print("usage: python telemetry.py LOG [PREFIX]")
+        sys.exit(1)
+
+    watch(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(sys.argv[1])[0])
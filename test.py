@@ -1,13 +1,25 @@
-from constants import sumoCmd, t_step, total_steps
+from constants import sumoCmd, t_step, total_steps, trace_dir
 from evaluation import Evaluator
+from compiled_ctrnn import CompiledCTRNN
+import backends
+import distributed
+import evaluation
+import threading
+import time
 import pickle
 import neat
 import os
 import statistics
 import random
-import csv
-from multiprocessing import Process, Array
-import multiprocessing
+import tempfile
+import workers
+import sweep
+import comparison
+import topology
+import traci
+from speciation import VectorSpeciesSet
+from recording import Trace
+from telemetry import TelemetryReporter
 
 
 def test_winner(config_file, w_path="neat/grid/winner-genome-1"):
@@ -22,77 +34,473 @@ def test_winner(config_file, w_path="neat/grid/winner-genome-1"):
 
     # Watch the winning genome perform
     ev = Evaluator(sumo_cmd=['sumo-gui'] + sumoCmd[1:] + ['--random'],
-                   runtime=total_steps)
-    net = neat.ctrnn.CTRNN.create(winner, config, t_step)
+                   runtime=total_steps, backend='traci')
+    net = CompiledCTRNN.create(winner, config, t_step)
     return ev.get_net_fitness(net)
 
 
-def test_baseline():
-    ev = Evaluator(sumo_cmd=['sumo-gui'] + sumoCmd[1:] + ['--random'],
-                   runtime=total_steps)
+def test_compiled_nets(config_file, w_paths, steps=total_steps, tol=1e-9):
+    """
+    Checks that CompiledCTRNN reproduces neat-python's CTRNN on stored genomes, feeding both the same random
+    occupancy inputs for a full run. Differences are relative, since argmax between two nearly saturated outputs
+    depends on their smallest digits. Returns the largest relative difference seen.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
 
-    return ev.run_baseline()
+    rng = random.Random(0)
+    worst = 0
+    for w_path in w_paths:
+        with open(w_path, 'rb') as f:
+            genome = pickle.load(f)
+
+        reference = neat.ctrnn.CTRNN.create(genome, config, t_step)
+        compiled = CompiledCTRNN.create(genome, config, t_step)
+
+        for _ in range(steps):
+            inputs = [rng.random() * 100 for _ in range(config.genome_config.num_inputs)]
+            expected = reference.advance(inputs, t_step, t_step)
+            actual = compiled.advance(inputs, t_step, t_step)
+            worst = max([worst] + [abs(a - b) / max(abs(a), abs(b)) for a, b in zip(expected, actual) if a != b])
+
+        if worst > tol:
+            raise AssertionError("Compiled net for {0} differs from neat-python by {1}".format(w_path, worst))
+
+    return worst
+
+
+def test_backends(config_file, w_path, seeds=(0, 1)):
+    """
+    Checks that every available backend (libsumo, traci, and a labelled traci connection) gives exactly the same
+    baseline and net fitness for each seed. Returns the fitnesses by backend.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    net = CompiledCTRNN.create(genome, config, t_step)
+    results = {}
+    for name, label in [(name, None) for name in backends.available()] + [('traci', 'test-backends')]:
+        ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps, backend=name, label=label)
+        key = name if label is None else '{0} ({1})'.format(name, label)
+        results[key] = [(ev.run_baseline(cmd=sumoCmd + ['--seed', str(seed)]),
+                         ev.get_net_fitness(net, cmd=sumoCmd + ['--seed', str(seed)])) for seed in seeds]
+        del ev
+
+    expected = next(iter(results.values()))
+    for key, fitnesses in results.items():
+        if fitnesses != expected:
+            raise AssertionError("Backend {0} gives {1}, expected {2}".format(key, fitnesses, expected))
+
+    return results
+
+
+def test_control_period(periods=(1, 3, 7), seeds=(0, 1)):
+    """
+    Checks that the baseline scores the same whatever the control period, as its time limit is applied every step.
+    Returns the scores by period.
+    """
+    results = {}
+    for period in periods:
+        ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps, control_period=period)
+        results[period] = [ev.run_baseline(cmd=sumoCmd + ['--seed', str(seed)]) for seed in seeds]
+        del ev
+
+    expected = results[periods[0]]
+    for period, scores in results.items():
+        if scores != expected:
+            raise AssertionError("Control period {0} gives baseline scores {1}, expected {2}".format(period, scores,
+                                                                                                   expected))
+
+    return results
+
+
+def count_puts(tasks):
+    """
+    Records the index of every task put on a task queue from now on, in the list returned.
+    """
+    queued = []
+    put = tasks.put
+
+    def counting_put(task, *args, **kwargs):
+        put(task, *args, **kwargs)
+        if task is not None:
+            queued.append(task[0])
+
+    tasks.put = counting_put
+    return queued
 
 
-def get_stats_auxiliary(array, seeds, config=None, genome=None):
-    """20
-    An auxiliary evaluation function needed for running simulations in parallel.
+def wait_for_held_jobs(tasks, queued, total, num, finished, run):
     """
+    Waits until all total jobs are queued (queued comes from count_puts) and each of num workers has taken one off the
+    task queue, with none finished yet (finished collects the jobs as they come back), so that every worker holds a
+    job in progress. Raises AssertionError if the moment is missed.
+    """
+    while (len(queued) < total or tasks.qsize() > total - num) and not finished and run.is_alive():
+        time.sleep(0.01)
+
+    if finished or not run.is_alive():
+        raise AssertionError("A job finished before every worker held one, the test did not kill a job in progress")
+
+
+def test_distributed(config_file, w_path, num=3, seeds=range(6)):
+    """
+    Runs a stored genome and the baseline through a coordinator with num workers on localhost, killing one worker
+    while it holds a job, and checks that every job still comes back with the same fitness as a local run.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    jobs = [(g, seed) for g in (genome, None) for seed in seeds]
+
     ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps)
-    fitnesses = [0 for _ in range(len(seeds))]
+    net = CompiledCTRNN.create(genome, config, t_step)
+    expected = [ev.get_net_fitness(net, cmd=sumoCmd + ['--seed', str(seed)]) if g is not None else
+                ev.run_baseline(cmd=sumoCmd + ['--seed', str(seed)]) for g, seed in jobs]
+    del ev
+
+    authkey = os.urandom(32)
+    coordinator = distributed.Coordinator(address=('localhost', 0), authkey=authkey, cached=False)
+    processes = distributed.start_workers(coordinator.address, num, authkey=authkey, retry=0.1)
+
+    fitnesses = []
+    finished = []
+    queued = count_puts(coordinator.tasks)
+    run = threading.Thread(target=lambda: fitnesses.extend(coordinator.evaluate(
+        jobs, config, on_result=lambda index, fitness, truncated, metrics: finished.append(index))))
+    run.start()
+    wait_for_held_jobs(coordinator.tasks, queued, len(jobs), num, finished, run)
+    processes[0].kill()
+    run.join()
+
+    coordinator.close()
+    for proc in processes:
+        proc.join()
 
-    if genome is not None:
-        if config is None:
-            raise ValueError("You need to provide a config if evaluating genomes")
-        net = neat.ctrnn.CTRNN.create(genome, config, t_step)
-        for i, s in enumerate(seeds):
-            fitnesses[i] = -1 * ev.get_net_fitness(net, cmd=sumoCmd + ['--seed', str(s)])
+    if fitnesses != expected:
+        raise AssertionError("Distributed fitnesses {0} differ from local ones {1}".format(fitnesses, expected))
 
-            array[i] = fitnesses[i]  # get score, write to shared array
-    else:
-        for i, s in enumerate(seeds):
-            fitnesses[i] = -1 * ev.run_baseline(cmd=sumoCmd + ['--seed', str(s)])
+    return fitnesses
+
+
+def test_worker_death(config_file, w_path, num=2, seeds=range(4)):
+    """
+    Kills a local pool worker while it holds a job and checks that evaluate raises instead of waiting for it forever,
+    and that the shared pool is started over afterwards.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    pool = workers.get_pool(num)
+    if pool.cache is not None:  # every job has to run
+        pool.cache.close()
+        pool.cache = None
+    jobs = [(genome, seed) for seed in seeds]
+
+    errors = []
+    finished = []
+    queued = count_puts(pool.tasks)
+
+    def evaluate():
+        try:
+            pool.evaluate(jobs, config, on_result=lambda index, fitness, truncated, metrics: finished.append(index))
+        except RuntimeError as e:
+            errors.append(e)
+
+    run = threading.Thread(target=evaluate)
+    run.start()
+    wait_for_held_jobs(pool.tasks, queued, len(jobs), num, finished, run)
+    pool.processes[0].kill()
+    run.join()
+
+    if not errors:
+        raise AssertionError("Evaluation finished although a worker died holding a job")
+    if workers.get_pool(num) is pool:
+        raise AssertionError("The pool that lost a worker is still in use")
+
+    return errors[0]
+
+
+def test_snapshots(config_file, w_path, seeds=range(5), warmup=60):
+    """
+    Runs the baseline and a stored genome on each seed after warmup seconds of warm-up, once simulating the warm-up
+    and twice with snapshots on (the first saving the warm-up, the second restoring it), and checks that all three
+    get the same score. Restoring is approximate (see Evaluator.restore_snapshot), so this fails on the seeds where
+    sumo loses state a run depends on. Returns the scores, keyed by controller and seed.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
 
-            array[i] = fitnesses[i]  # get score, write to shared array
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    net = CompiledCTRNN.create(genome, config, t_step)
+    runs = [('baseline', seed) for seed in seeds] + [('net', seed) for seed in seeds]
+    scores = dict((run, []) for run in runs)
+
+    settings = evaluation.use_snapshots, evaluation.warmup_time
+    try:
+        for snapshots, repeats in ((False, 1), (True, 2)):
+            evaluation.use_snapshots, evaluation.warmup_time = snapshots, warmup
+            ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps)
+            for _ in range(repeats):
+                for name, seed in runs:
+                    cmd = sumoCmd + ['--seed', str(seed)]
+                    scores[name, seed].append(ev.run_baseline(cmd=cmd) if name == 'baseline' else
+                                              ev.get_net_fitness(net, cmd=cmd))
+            del ev
+    finally:
+        evaluation.use_snapshots, evaluation.warmup_time = settings
+
+    differ = ["{0} on seed {1}: simulated {2}, saved {3}, restored {4}".format(name, seed, *scores[name, seed])
+              for name, seed in runs if len(set(scores[name, seed])) > 1]
+    if differ:
+        raise AssertionError("Snapshots change the score of {0} of {1} runs:\n{2}".format(
+            len(differ), len(runs), '\n'.join(differ)))
+
+    return scores
+
+
+def test_topology(configs=('sumo/cbd/tinycbd.sumocfg', 'sumo/grid/grid.sumocfg', 'sumo/cross/cross.sumocfg')):
+    """
+    Checks the topology index of each scenario against what sumo reports over traci: the light and loop ids in order,
+    the lanes each light controls, where each loop sits, and the speed and length of every lane.
+    """
+    for config in configs:
+        cmd = ['sumo', '-c', config]
+        index = topology.build_index(cmd)
+        traci.start(cmd, label='test-topology')
+        conn = traci.getConnection('test-topology')
+
+        checks = [('lights', list(index.tls_ids), list(conn.trafficlight.getIDList())),
+                  ('loops', list(index.loop_ids), list(conn.inductionloop.getIDList()))]
+        checks += [(tlsID, index.tls[tlsID]['lanes'], list(conn.trafficlight.getControlledLanes(tlsID)))
+                   for tlsID in index.tls_ids]
+        checks += [(loopID, (index.loops[loopID]['lane'], round(index.loops[loopID]['pos'], 6)),
+                    (conn.inductionloop.getLaneID(loopID), round(conn.inductionloop.getPosition(loopID), 6)))
+                   for loopID in index.loop_ids]
+        checks += [(laneID, (lane['speed'], round(lane['length'], 6)),
+                    (conn.lane.getMaxSpeed(laneID), round(conn.lane.getLength(laneID), 6)))
+                   for laneID, lane in index.lanes.items()]
+        conn.close()
+
+        for name, actual, expected in checks:
+            if actual != expected:
+                raise AssertionError("{0} {1}: index has {2}, sumo has {3}".format(config, name, actual, expected))
+
+
+def test_generated_demand(seeds=range(4)):
+    """
+    Checks that generated demand gives every seed its own trips, and that a seed gives the same trips and the same
+    baseline score each time it is run. Returns the baseline scores.
+    """
+    ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps, generated_demand=True)
+
+    samples = [ev.demand.sample(seed) for seed in seeds]
+    if len(set(map(tuple, samples))) != len(samples):
+        raise AssertionError("Two seeds were given the same trips")
+
+    scores = [ev.run_baseline(cmd=sumoCmd + ['--seed', str(seed)]) for seed in seeds]
+    for seed, score, sample in zip(seeds, scores, samples):
+        repeat = ev.run_baseline(cmd=sumoCmd + ['--seed', str(seed)])
+        if repeat != score or ev.demand.sample(seed) != sample:
+            raise AssertionError("Seed {0} scored {1} and then {2}".format(seed, score, repeat))
+        if ev.get_metrics()['vehicles'] != len(sample):
+            raise AssertionError("Seed {0} ran {1} of its {2} trips".format(seed, ev.get_metrics()['vehicles'],
+                                                                             len(sample)))
+
+    return scores
+
+
+def test_speciation(config_file, generations=10, pop_size=300, seed=0):
+    """
+    Evolves a population on random fitnesses with VectorSpeciesSet, speciating every generation with a
+    DefaultSpeciesSet as well, and checks that both give each genome the same species and representative. Returns the
+    seconds each spent speciating.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+    config.species_set_type = VectorSpeciesSet  # uses the DefaultSpeciesSet settings parsed above
+    config.pop_size = pop_size
+    random.seed(seed)
+
+    p = neat.Population(config)
+    default = neat.DefaultSpeciesSet(config.species_set_config, p.reporters)
+    default.speciate(config, p.population, 0)
+    if default.genome_to_species != p.species.genome_to_species:
+        raise AssertionError("The first generation was speciated differently")
+
+    times = [0.0, 0.0]
+    for generation in range(1, generations + 1):
+        for genome in p.population.values():
+            genome.fitness = random.random()
+
+        # the reproduction below is the same as Population.run's, so both species sets see the same genomes
+        p.population = p.reproduction.reproduce(config, p.species, config.pop_size, generation)
+        # reproduction drops stagnant species and reorders the rest, which sets the order representatives are chosen in
+        default.species = dict((sid, default.species[sid]) for sid in p.species.species)
+        state = random.getstate()
+
+        start = time.perf_counter()
+        default.speciate(config, p.population, generation)
+        times[0] += time.perf_counter() - start
+        start = time.perf_counter()
+        p.species.speciate(config, p.population, generation)
+        times[1] += time.perf_counter() - start
+        random.setstate(state)
+
+        for name, expected, actual in (
+                ('species', default.genome_to_species, p.species.genome_to_species),
+                ('representatives', dict((sid, s.representative.key) for sid, s in default.species.items()),
+                 dict((sid, s.representative.key) for sid, s in p.species.species.items()))):
+            if actual != expected:
+                raise AssertionError("Generation {0} has different {1}".format(generation, name))
+
+    return times
+
+
+def test_telemetry(config_file, generations=8, seed=0):
+    """
+    Evolves a population on random fitnesses with both neat's StatisticsReporter and a TelemetryReporter, and checks
+    that the log read back gives the same fitness means and deviations, best fitnesses, species sizes and best
+    genomes, and that a log followed during the run ends up the same as one read afterwards.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+    config.species_set_type = VectorSpeciesSet  # uses the DefaultSpeciesSet settings parsed above
+    random.seed(seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        p = neat.Population(config)
+        stats = neat.StatisticsReporter()
+        telemetry = TelemetryReporter(os.path.join(directory, 'telemetry.jsonl'))
+        p.add_reporter(stats)
+        p.add_reporter(telemetry)
+
+        followed = []
+
+        def fitness_function(genomes, config):
+            for _, genome in genomes:
+                genome.fitness = random.random()
+            if followed:
+                followed[0].update()
+            else:
+                followed.append(telemetry.read())
+
+        p.run(fitness_function, generations)
+        log = telemetry.read()
+        followed[0].update()
+
+        checks = [('fitness means', stats.get_fitness_mean(), log.get_fitness_mean()),
+                  ('fitness deviations', stats.get_fitness_stdev(), log.get_fitness_stdev()),
+                  ('best fitnesses', [g.fitness for g in stats.most_fit_genomes], log.get_best_fitness()),
+                  ('species sizes', stats.get_species_sizes(), log.get_species_sizes()),
+                  ('best genomes', [str(g) for g in stats.best_unique_genomes(5)],
+                   [str(g) for g in log.best_unique_genomes(5)]),
+                  ('followed log', log.records, followed[0].records)]
+
+    for name, expected, actual in checks:
+        if actual != expected:
+            raise AssertionError("The telemetry log has different {0}".format(name))
+
+
+def record_genome(config_file, w_path, seeds=range(10)):
+    """
+    Records a stored genome on each seed in fast headless runs and saves the traces under trace_dir, to be watched
+    later with watch_trace. Returns the paths.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps, backend='fastest')
+    os.makedirs(trace_dir, exist_ok=True)
+    paths = []
+    for seed in seeds:
+        trace = ev.record(CompiledCTRNN.create(genome, config, t_step), cmd=sumoCmd + ['--seed', str(seed)])
+        paths.append(os.path.join(trace_dir, '{0}-seed-{1}.npz'.format(os.path.basename(w_path), seed)))
+        trace.save(paths[-1])
+        print("Seed {0}: fitness {1}, {2} decisions".format(seed, trace.fitness, len(trace)))
+
+    return paths
+
+
+def watch_trace(path):
+    """
+    Replays a recorded trace in sumo-gui, without the net. Returns the score, which is the recorded one.
+    """
+    ev = Evaluator(sumo_cmd=['sumo-gui'] + sumoCmd[1:], runtime=total_steps, backend='traci')
+    return ev.replay(Trace.load(path))
+
+
+def test_replay(config_file, w_path, seeds=(0, 1)):
+    """
+    Records a stored genome on each seed with the fastest backend, and checks that replaying the saved trace over
+    traci, without the net, follows the recording step for step and gets the recorded fitness. Returns the fitnesses.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    with open(w_path, 'rb') as f:
+        genome = pickle.load(f)
+
+    ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps, backend='fastest')
+    traces = [ev.record(CompiledCTRNN.create(genome, config, t_step), cmd=sumoCmd + ['--seed', str(seed)])
+              for seed in seeds]
+    del ev
+
+    ev = Evaluator(sumo_cmd=sumoCmd, runtime=total_steps, backend='traci', label='test-replay')
+    fitnesses = []
+    with tempfile.TemporaryDirectory() as directory:
+        for seed, trace in zip(seeds, traces):
+            path = os.path.join(directory, 'seed-{0}.npz'.format(seed))
+            trace.save(path)
+            fitness = ev.replay(Trace.load(path))  # raises if the run strays from the recording
+            if fitness != trace.fitness:
+                raise AssertionError("Seed {0} replayed to {1}, recorded {2}".format(seed, fitness, trace.fitness))
+            fitnesses.append(fitness)
+
+    return fitnesses
+
+
+def test_baseline():
+    ev = Evaluator(sumo_cmd=['sumo-gui'] + sumoCmd[1:] + ['--random'],
+                   runtime=total_steps, backend='traci')
+
+    return ev.run_baseline()
 
 
 def get_stats_parallel(config=None, num=None, n=100, genome=None):
-    if num is None:
-        num = multiprocessing.cpu_count()
-
-    chunk_size = n // num
-    splits = [[0 for _ in range(chunk_size + 1)] for _ in range(n % num)] \
-             + [[0 for _ in range(chunk_size)] for _ in range(num - n % num)]  # split the jobs between processes
-    arrays = [Array('d', len(split)) for split in splits]  # each process shares an array with the parent process
-
-    processes = []
-
-    k = 0
-    for split in splits:  # distribute genomes
-        for i in range(len(split)):
-            split[i] = k
-            k += 1
-
-    for i in range(num):  # initiate processes
-        new_proc = Process(target=get_stats_auxiliary,
-                           kwargs={'genome': genome,
-                                   'config': config,
-                                   'array': arrays[i],
-                                   'seeds': splits[i]})
-        processes.append(new_proc)
-        new_proc.start()
-
-    for proc in processes:  # stop processes
-        proc.join()
+    """
+    Scores a genome (or the baseline if genome is None) on seeds 0..n-1 using the shared worker pool.
+    """
+    if genome is not None and config is None:
+        raise ValueError("You need to provide a config if evaluating genomes")
 
-    output = [0 for _ in range(n)]
-    k = 0
-    for array in arrays:  # collect all the fitnesses and modify genomes accordingly
-        for i in range(len(array)):
-            output[k] = array[i]
-            k += 1
+    pool = workers.get_pool(num)
+    fitnesses = pool.evaluate([(genome, s) for s in range(n)], config)
 
-    return output
+    return [-1 * f for f in fitnesses]
 
 
 def get_genome_stats(config_file, w_path=None, genome=None, output_path=None, n=100):
@@ -110,29 +518,62 @@ def get_genome_stats(config_file, w_path=None, genome=None, output_path=None, n=
     else:
         raise ValueError("Exactly one of 'w_path' and 'genome' arguments is required.")
 
-    scores = get_stats_parallel(config, n=n, genome=winner)
+    print_stats(output_path, n, winner, config)
 
-    if output_path is not None:
-        with open(output_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            for val in scores:
-                writer.writerow([val])
 
-    print("Average score: ", (sum(scores) / n))
-    print("Standard deviation: ", statistics.stdev(scores))
+def get_baseline_stats(output_path=None, n=1000):
+    print_stats(output_path, n)
 
 
-def get_baseline_stats(output_path=None, n=1000):
-    scores = get_stats_parallel(n=n)
+def test_t_critical():
+    """
+    Checks the Student t critical values of paired comparisons against printed two-sided tables.
+    """
+    table = {(0.05, 1): 12.706, (0.05, 2): 4.303, (0.05, 5): 2.571, (0.05, 9): 2.262, (0.05, 30): 2.042,
+             (0.01, 9): 3.250, (0.001, 4): 8.610}
+    for (alpha, df), expected in table.items():
+        found = comparison.t_critical(alpha, df)
+        if abs(found - expected) > 1e-3:
+            raise AssertionError("t critical value {0} for alpha {1} and {2} df, expected {3}".format(
+                found, alpha, df, expected))
+
+
+def compare_genomes(config_file, w_paths, baseline=True, num=None):
+    """
+    Ranks stored genomes (and the baseline) against each other on shared seeds, stopping as soon as the ranking is
+    clear (see comparison.PairedComparison). Returns the ranking of the paths.
+    """
+    config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                         config_file)
+
+    candidates = {}
+    for w_path in w_paths:
+        with open(w_path, 'rb') as f:
+            candidates[w_path] = pickle.load(f)
+    if baseline:
+        candidates['baseline'] = None
+
+    compared = comparison.PairedComparison(candidates, config)
+    ranking = compared.run(num)
+    print(compared.report())
+
+    return ranking
 
+
+def print_stats(output_path, n, genome=None, config=None):
+    """
+    Scores a genome (or the baseline) on seeds 0..n-1. With an output path every run is streamed to it as a csv row
+    (see sweep.StatsSweep) and seeds already there are skipped.
+    """
     if output_path is not None:
-        with open(output_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            for val in scores:
-                writer.writerow([val])
+        _, mean, stdev = sweep.StatsSweep(output_path, genome, config, seeds=range(n)).run()
+    else:
+        scores = get_stats_parallel(config, n=n, genome=genome)
+        mean, stdev = sum(scores) / n, statistics.stdev(scores)
 
-    print("Average score: ", (sum(scores) / n))
-    print("Standard deviation: ", statistics.stdev(scores))
+    print("Average score: ", mean)
+    print("Standard deviation: ", stdev)
 
 
 if __name__ == "__main__":
@@ -140,10 +581,12 @@ if __name__ == "__main__":
     config_path = os.path.join(local_dir, 'neat/config-ctrnn-cbd')
 
     # get_genome_stats(config_path, w_path='neat/cbd/winner-genome-8_2',
-    #                  output_path='data/cbd/winner-8_stats.csv', n=1000)
-    # get_baseline_stats(n=1000, output_path='data/cbd/baseline_stats.csv')
+    #                  output_path='data/cbd/winner-8_sweep.csv', n=1000)
+    # get_baseline_stats(n=1000, output_path='data/cbd/baseline_sweep.csv')
+    # compare_genomes(config_path, ['neat/cbd/winner-genome-8_2', 'neat/cbd/winner-genome-8'])
 
     print(test_winner(config_file=config_path, w_path='neat/cbd/winner-genome-8_2'))
+    # print(watch_trace(record_genome(config_path, 'neat/cbd/winner-genome-8_2', seeds=[0])[0]))
     # print(test_baseline())
 
     # get_genome_stats(config_path, genome=genome_list[1], output_path=None, n=1000)
@@ -0,0 +1,141 @@
+import math
+
+
+class QuantileSketch:
+    """
+    A bounded-memory quantile sketch over non-negative values. Values fall into logarithmic buckets whose width grows
+    with their size, so any quantile comes back within a relative error of accuracy, and the number of buckets only
+    grows with the log of the largest value. The count, sum and maximum are kept exactly.
+    """
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = 1e-6  # anything smaller is counted as zero
+
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+        if value < self.min_value:
+            self.zeros += 1
+        else:
+            index = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        for index, n in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + n
+
+    def copy(self):
+        sketch = QuantileSketch(self.accuracy)
+        sketch.merge(self)
+        return sketch
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile (0 <= q <= 1) of the values added so far, or 0 if there are none.
+        """
+        if self.count == 0:
+            return 0
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:  # the midpoint of the bucket, in relative terms
+                return min(2 * self.gamma ** index / (self.gamma + 1), self.max)
+
+        return self.max
+
+
+class TimeLossAggregator:
+    """
+    Running time loss statistics for a simulation. Each vehicle's time loss is held only while it is on the road and
+    folded into a running sum and a quantile sketch once it arrives, so memory stays bounded by the vehicles currently
+    running rather than by every vehicle that has departed.
+    """
+
+    def __init__(self, accuracy=0.01):
+        self.done = QuantileSketch(accuracy)
+        self.results = {}
+        self.var = None  # when set, results holds each running vehicle's subscription results rather than its time loss
+
+    @property
+    def live(self):
+        """
+        The latest time loss of every running vehicle, read out of the subscription results on first use.
+        """
+        if self.var is not None:
+            self.results = {veh_id: values[self.var] for veh_id, values in self.results.items()}
+            self.var = None
+        return self.results
+
+    def update(self, live, arrived=(), var=None):
+        """
+        Takes the latest time loss of every running vehicle and the IDs of the vehicles that arrived since the last
+        update. An arrived vehicle keeps the last time loss it was seen with. With var, live maps each vehicle to its
+        subscription results instead, and only the arrived vehicles' time losses (under var) are read until the
+        statistics are asked for, so updating every step costs little.
+        """
+        for veh_id in arrived:
+            value = self.results.get(veh_id)
+            if value is not None:
+                self.done.add(value if self.var is None else value[self.var])
+
+        self.results = live
+        self.var = var
+
+    def copy(self):
+        aggregator = TimeLossAggregator(self.done.accuracy)
+        aggregator.done = self.done.copy()
+        aggregator.results = dict(self.live)
+        return aggregator
+
+    def __len__(self):  # every vehicle seen so far, arrived or not
+        return self.done.count + len(self.results)
+
+    def total(self):
+        return self.done.total + sum(self.live.values())
+
+    def mean(self):
+        n = len(self)
+        if n == 0:
+            return 0
+        return self.total() / n
+
+    def sketch(self):
+        """
+        Returns a sketch of every vehicle seen so far, including the ones still running.
+        """
+        if not self.live:
+            return self.done
+
+        sketch = self.done.copy()
+        for value in self.live.values():
+            sketch.add(value)
+        return sketch
+
+    def quantile(self, q):
+        return self.sketch().quantile(q)
+
+    def max(self):
+        return max(self.done.max, max(self.live.values(), default=0))
@@ -0,0 +1,227 @@
+from constants import topology_dir
+import hashlib
+import math
+import os
+import pickle
+import sys
+import xml.etree.ElementTree as ET
+from collections import deque
+
+local_dir = os.path.dirname(os.path.abspath(__file__))
+
+max_upstream_hops = 4  # lanes a loop may sit upstream of the light it feeds
+default_period = 900.0  # seconds aggregated by a loop that sets no period, as in sumo
+
+
+def get_input_files(sumo_cmd):
+    """
+    Returns the directory of a command's sumocfg and the input options (net-file, additional-files, ...) sumo will
+    use, with the ones given on the command line taking precedence over the sumocfg.
+    """
+    config_file = sumo_cmd[sumo_cmd.index('-c') + 1]
+    config_dir = os.path.dirname(config_file)
+    options = dict((element.tag, element.get('value')) for element in ET.parse(config_file).getroot().find('input'))
+
+    for flag, name in (('-n', 'net-file'), ('--net-file', 'net-file'), ('-a', 'additional-files'),
+                       ('--additional-files', 'additional-files')):
+        if flag in sumo_cmd:
+            options[name] = sumo_cmd[sumo_cmd.index(flag) + 1]
+            config_dir = ''
+
+    return config_dir, options
+
+
+def get_source_files(sumo_cmd):
+    """
+    Returns the net file and additional files of a command, in the order sumo loads them.
+    """
+    config_dir, options = get_input_files(sumo_cmd)
+    names = [options['net-file']] + options.get('additional-files', '').split(',')
+    return [os.path.join(config_dir, name.strip()) for name in names if name.strip()]
+
+
+def fingerprint(files):
+    """
+    Hashes the source files of an index along with this module, so that a change to either rebuilds it.
+    """
+    h = hashlib.sha256()
+    for path in files + [os.path.join(local_dir, 'topology.py')]:
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+
+    return h.hexdigest()
+
+
+class Topology:
+    """
+    What the controller needs to know about a scenario's network, read from its net and additional files without
+    starting sumo:
+
+    tls_ids, loop_ids: the traffic lights and induction loops in the order sumo lists them (sorted by id), which is
+        the order of the net outputs and inputs.
+    programs: tls id -> [(duration in seconds, state)] for each light's fixed-time program, later files overriding
+        earlier ones as they do in sumo. Lights running anything else are left out.
+    tls: tls id -> {'links': [(from lane, to lane, via lane)] by link index (None for an unused index), 'lanes': the
+        incoming lane of each link as sumo lists them (unused indices skipped), 'approaches': {'NS': lanes, 'EW': lanes}}, the approaches being the lanes the green phase for each direction
+        serves (phase 1 for NS and 3 for EW, see Evaluator.set_phase).
+    loops: loop id -> {'lane', 'pos' (from the start of the lane), 'period', 'tls', 'approach', 'distance'}, where
+        period is the seconds each of its intervals aggregates, tls and approach are those of the first controlled
+        lane at or downstream of the loop (None if there is none close by) and distance is how far the loop is from
+        that lane's stop line.
+    lanes: lane id -> {'edge', 'speed', 'length', 'heading'}, heading being the compass bearing of the lane's last
+        segment in degrees. Internal lanes are left out.
+    """
+
+    def __init__(self, files):
+        self.fingerprint = fingerprint(files)
+        self.lanes = {}
+        self.programs = {}
+        self.tls = {}
+        self.loops = {}
+
+        successors = {}
+        for element in ET.parse(files[0]).getroot():
+            if element.tag == 'edge' and element.get('function') != 'internal':
+                for lane in element.iter('lane'):
+                    self.lanes[lane.get('id')] = {'edge': element.get('id'), 'speed': float(lane.get('speed')),
+                                                  'length': float(lane.get('length')),
+                                                  'heading': get_heading(lane.get('shape'))}
+            elif element.tag == 'connection' and not element.get('from').startswith(':'):
+                from_lane = '{0}_{1}'.format(element.get('from'), element.get('fromLane'))
+                to_lane = '{0}_{1}'.format(element.get('to'), element.get('toLane'))
+                successors.setdefault(from_lane, []).append(to_lane)
+
+                if element.get('tl') is not None:
+                    links = self.tls.setdefault(element.get('tl'), {}).setdefault('links', {})
+                    links[int(element.get('linkIndex'))] = (from_lane, to_lane, element.get('via'))
+
+        for path in files:
+            root = ET.parse(path).getroot()
+            for logic in root.iter('tlLogic'):
+                if logic.get('type', 'static') != 'static':
+                    self.programs.pop(logic.get('id'), None)
+                    continue
+                self.programs[logic.get('id')] = [(float(phase.get('duration')), phase.get('state'))
+                                                  for phase in logic.iter('phase')]
+
+            for loop in list(root.iter('inductionLoop')) + list(root.iter('e1Detector')):
+                lane = loop.get('lane')
+                pos = float(loop.get('pos'))
+                if pos < 0:
+                    pos += self.lanes[lane]['length']
+                self.loops[loop.get('id')] = {'lane': lane, 'pos': pos,
+                                              'period': float(loop.get('period', loop.get('freq', default_period)))}
+
+        for tlsID, light in self.tls.items():
+            links = light['links']
+            light['links'] = [links.get(i) for i in range(max(links) + 1)]
+            light['lanes'] = [link[0] for link in light['links'] if link]
+            light['approaches'] = {'NS': [], 'EW': []}
+
+            phases = self.programs.get(tlsID, [])
+            for direction, phase in (('NS', 1), ('EW', 3)):
+                if phase >= len(phases):
+                    continue
+                for i, link in enumerate(light['links']):
+                    if link and phases[phase][1][i] in 'Gg' and link[0] not in light['approaches'][direction]:
+                        light['approaches'][direction].append(link[0])
+
+        controlled = {}  # lane -> (tls, approach)
+        for tlsID, light in self.tls.items():
+            for direction, lanes in light['approaches'].items():
+                for lane in lanes:
+                    controlled.setdefault(lane, (tlsID, direction))
+            for lane in light['lanes']:
+                controlled.setdefault(lane, (tlsID, None))
+
+        for loop in self.loops.values():
+            loop['tls'], loop['approach'], loop['distance'] = None, None, None
+
+            queue = deque([(loop['lane'], 0, self.lanes[loop['lane']]['length'] - loop['pos'])])
+            seen = set()
+            while queue:  # breadth first, so the nearest controlled lane wins
+                lane, hops, distance = queue.popleft()
+                if lane in controlled:
+                    loop['tls'], loop['approach'] = controlled[lane]
+                    loop['distance'] = distance
+                    break
+
+                seen.add(lane)
+                if hops < max_upstream_hops:
+                    for successor in successors.get(lane, []):
+                        if successor not in seen:
+                            queue.append((successor, hops + 1, distance + self.lanes[successor]['length']))
+
+        self.tls_ids = sorted(set(self.tls) | set(self.programs))  # sumo keeps its ids in sorted containers
+        self.loop_ids = sorted(self.loops)
+
+    def get_durations(self, t_step):
+        """
+        Returns the phase durations of every fixed-time light in simulation steps.
+        """
+        return dict((tlsID, [int(round(duration / t_step)) for duration, _ in phases])
+                    for tlsID, phases in self.programs.items())
+
+
+def get_heading(shape):
+    points = [tuple(map(float, point.split(','))) for point in shape.split()]
+    (x0, y0), (x1, y1) = points[-2][:2], points[-1][:2]
+    return math.degrees(math.atan2(x1 - x0, y1 - y0)) % 360
+
+
+def index_path(sumo_cmd):
+    config_file = sumo_cmd[sumo_cmd.index('-c') + 1]
+    name = os.path.splitext(os.path.basename(config_file))[0]
+    return os.path.join(topology_dir, '{0}-{1}.pkl'.format(
+        name, hashlib.sha256(repr(get_source_files(sumo_cmd)).encode()).hexdigest()[:8]))
+
+
+_loaded = {}
+
+
+def get_topology(sumo_cmd):
+    """
+    Returns the topology index of a command's scenario, loading it from topology_dir, or building and storing it there
+    if it is missing or its source files have changed since it was built.
+    """
+    files = get_source_files(sumo_cmd)
+    key = tuple(files)
+    current = fingerprint(files)
+    if key in _loaded and _loaded[key].fingerprint == current:
+        return _loaded[key]
+
+    path = index_path(sumo_cmd)
+    topology = None
+    if os.path.exists(path):
+        topology = Topology.__new__(Topology)
+        with open(path, 'rb') as f:
+            topology.__dict__.update(pickle.load(f))
+
+    if topology is None or topology.fingerprint != current:
+        topology = build_index(sumo_cmd)
+
+    _loaded[key] = topology
+    return topology
+
+
+def build_index(sumo_cmd):
+    """
+    Builds the topology index of a command's scenario and stores it in topology_dir.
+    """
+    topology = Topology(get_source_files(sumo_cmd))
+
+    path = index_path(sumo_cmd)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open('{0}.{1}.tmp'.format(path, os.getpid()), 'wb') as f:  # workers may build the same index at once
+        pickle.dump(vars(topology), f, protocol=pickle.HIGHEST_PROTOCOL)  # plain data, loadable from any module
+    os.replace('{0}.{1}.tmp'.format(path, os.getpid()), path)
+
+    return topology
+
+
+if __name__ == '__main__':
+    # python topology.py [SUMOCFG ...] builds the index of each scenario ahead of time
+    for config in sys.argv[1:] or ['sumo/cbd/tinycbd.sumocfg']:
+        topology = build_index(['sumo', '-c', config])
+        print("{0}: {1} lights, {2} loops, {3} lanes".format(config, len(topology.tls_ids), len(topology.loop_ids),
+                                                            len(topology.lanes)))
@@ -1,107 +1,462 @@
-from constants import sumoCmd, t_step, total_steps
+from constants import sumoCmd, t_step, total_steps, use_cache, cutoff_percentile
+from constants import use_racing, racing_initial_seeds, racing_z, profile_evaluator, coordinator_address
+from constants import checkpoint_dir, checkpoint_full_interval
+from constants import use_screening, screen_fraction, screen_seeds, screen_time, screen_audit
+from constants import use_islands, islands, migration_interval, migration_size
+import math
 import multiprocessing
 import os
+import queue
+import random
+import statistics
 import neat
 import visualize
+import cache
 import evaluation
+from compiled_ctrnn import CompiledCTRNN
+import workers
+import distributed
+from checkpoint import IncrementalCheckpointer
+from speciation import VectorSpeciesSet
+from telemetry import TelemetryReporter
 import pickle
-from multiprocessing import Process, Array
 
 
 def eval_genomes(genomes, config, runs_per_net=1):
-    ev = evaluation.Evaluator(sumo_cmd=sumoCmd, runtime=total_steps)
+    ev = evaluation.Evaluator.create(sumo_cmd=sumoCmd, runtime=total_steps)
+    store = cache.EvaluationCache() if use_cache else None
     fitnesses = [[0 for _ in range(runs_per_net)] for _ in range(len(genomes))]
     for i, genome in enumerate(genomes):
         for j in range(runs_per_net):
-            net = neat.ctrnn.CTRNN.create(genome[1], config, t_step)
+            key = cache.job_key(genome[1], j)
+            cached = store.get_many([key]) if store is not None else {}
+            if key in cached:
+                fitnesses[i][j] = cached[key]
+                continue
+
+            net = CompiledCTRNN.create(genome[1], config, t_step)
             fitnesses[i][j] = ev.get_net_fitness(net, cmd=sumoCmd + ['--seed', str(j)])
 
+            if store is not None:
+                store.put_many({key: fitnesses[i][j]})
+
         genome[1].fitness = sum(fitnesses[i]) / runs_per_net  # get score
 
+    if profile_evaluator:
+        print(ev.take_profile().report('Generation profile'))
+
+
+def print_profile(pool):
+    profile, workers_report = pool.take_profile()
+    print(profile.report('Generation profile'))
+    print(workers_report)
+
+
+previous_scores = []  # per-run scores of the last generation, used to set the early termination cutoff
+
 
-def eval_genomes_auxiliary(genomes, config, array, runs_per_net=25):
-    """20
-    An auxiliary evaluation function needed for running simulations in parallel.
+def get_cutoff(percentile=cutoff_percentile):
     """
-    ev = evaluation.Evaluator(sumo_cmd=sumoCmd, runtime=total_steps)
-    fitnesses = [[0 for _ in range(runs_per_net)] for _ in range(len(genomes))]
-    for i, genome in enumerate(genomes):
-        net = neat.ctrnn.CTRNN.create(genome[1], config, t_step)
-        for j in range(runs_per_net):
-            fitnesses[i][j] = ev.get_net_fitness(net, cmd=sumoCmd + ['--seed', str(j)])
+    Returns the score below which runs are stopped early: the given percentile of the previous generation's run
+    scores, or None if early termination is off or there is no previous generation yet.
+    """
+    if percentile is None or len(previous_scores) < 2:
+        return None
 
-        array[i] = sum(fitnesses[i]) / runs_per_net  # get score, write to shared array
+    return statistics.quantiles(previous_scores, n=100)[percentile - 1]
 
 
-def eval_genomes_parallel(genomes, config, num=None):
-    if num is None:
-        num = multiprocessing.cpu_count()
+shared_pool = None  # an island's view of the workers of the process that started it, see run_islands
 
-    n = len(genomes)
-    chunk_size = n // num
-    splits = [[None for _ in range(chunk_size + 1)] for _ in range(n % num)] \
-             + [[None for _ in range(chunk_size)] for _ in range(num - n % num)]  # split the jobs between processes
-    arrays = [Array('d', len(split)) for split in splits]  # each process shares an array with the parent process
 
-    processes = []
+def get_pool(num=None):
+    """
+    Returns the remote worker coordinator if coordinator_address is set, otherwise the local worker pool.
+    """
+    if shared_pool is not None:
+        return shared_pool
+    if coordinator_address is not None:
+        return distributed.get_coordinator()
+    return workers.get_pool(num)
 
-    k = 0
-    for split in splits:  # distribute genomes
-        for i in range(len(split)):
-            split[i] = genomes[k]
-            k += 1
 
-    for i in range(num):  # initiate processes
-        new_proc = Process(target=eval_genomes_auxiliary,
-                           kwargs={'genomes': splits[i],
-                                   'config': config,
-                                   'array': arrays[i]})
-        processes.append(new_proc)
-        new_proc.start()
+checkpointer = None  # set by run when checkpointing is on
 
-    for proc in processes:  # stop processes
-        proc.join()
 
-    k = 0
-    for array in arrays:  # collect all the fitnesses and modify genomes accordingly
-        for i in range(len(array)):
-            genomes[k][1].fitness = array[i]
-            k += 1
+def run_jobs(pool, jobs, config, cutoff=None, runtime=total_steps):
+    """
+    Runs (genome, seed) jobs on the pool, simulating runtime steps each, and returns their fitnesses and truncated
+    flags. With checkpointing on, jobs already journalled in this generation are not run again and the rest are
+    journalled as they finish.
+    """
+    if checkpointer is None:
+        fitnesses = pool.evaluate(jobs, config, cutoff=cutoff, runtime=runtime)
+        return fitnesses, pool.truncated
+
+    keys = [cache.job_key(genome, seed, runtime=runtime) for genome, seed in jobs]
+    done = checkpointer.completed()
+    todo = [i for i, key in enumerate(keys) if key not in done]
+    if len(todo) < len(jobs):
+        print("Resuming with {0} of {1} runs already done".format(len(jobs) - len(todo), len(jobs)))
+
+    results = pool.evaluate([jobs[i] for i in todo], config, cutoff=cutoff, runtime=runtime,
+                            on_result=lambda j, fitness, truncated, _: checkpointer.record(keys[todo[j]], fitness,
+                                                                                            truncated))
+    for j, i in enumerate(todo):
+        done[keys[i]] = (results[j], pool.truncated[j])
+
+    return [done[key][0] for key in keys], [done[key][1] for key in keys]
+
+
+def eval_genomes_parallel(genomes, config, num=None, runs_per_net=25):
+    """
+    Evaluates a generation on the shared worker pool. Every (genome, seed) pair is a separate job, so workers stay
+    busy until the whole generation is done.
+    """
+    global previous_scores
+
+    pool = get_pool(num)
+
+    jobs = [(genome, seed) for _, genome in genomes for seed in range(runs_per_net)]
+    cutoff = get_cutoff()
+    fitnesses, truncated = run_jobs(pool, jobs, config, cutoff=cutoff)
+
+    if cutoff is not None:
+        print("Stopped {0} of {1} runs early (cutoff {2:.2f})".format(sum(truncated), len(jobs), cutoff))
+    previous_scores = fitnesses
+
+    if profile_evaluator:
+        print_profile(pool)
+
+    for i, (_, genome) in enumerate(genomes):  # reduce the per-seed results back into each genome
+        genome.fitness = sum(fitnesses[i * runs_per_net: (i + 1) * runs_per_net]) / runs_per_net
+
+
+def eval_genomes_racing(genomes, config, num=None, runs_per_net=25, initial_seeds=racing_initial_seeds, z=racing_z):
+    """
+    Evaluates a generation by racing. Every genome starts on the same few seeds, and the seed count doubles each round
+    (up to runs_per_net) for the genomes still in the race. A genome drops out once the top of its confidence interval
+    (mean + z standard errors) falls below the median of the genomes still racing.
+
+    Every genome sees the same seeds in the same order, so a genome that dropped out early is scored on a common
+    scale: its mean is corrected by how hard its seeds were for the genomes that finished, relative to all seeds.
+    """
+    if initial_seeds < 2:
+        raise ValueError("Racing needs at least two initial seeds to estimate the spread of a genome's scores.")
+
+    pool = get_pool(num)
+
+    scores = [[] for _ in genomes]
+    racing = list(range(len(genomes)))
+    seeds = 0
+    while racing and seeds < runs_per_net:
+        new_seeds = range(seeds, min(runs_per_net, max(initial_seeds, 2 * seeds)))
+        jobs = [(genomes[i][1], seed) for i in racing for seed in new_seeds]
+        fitnesses, _ = run_jobs(pool, jobs, config)
+
+        for k, i in enumerate(racing):
+            scores[i].extend(fitnesses[k * len(new_seeds): (k + 1) * len(new_seeds)])
+        seeds = new_seeds.stop
+
+        if seeds < runs_per_net:
+            means = dict((i, statistics.mean(scores[i])) for i in racing)
+            median = statistics.median(means.values())
+            racing = [i for i in racing
+                      if means[i] + z * statistics.stdev(scores[i]) / len(scores[i]) ** 0.5 >= median]
+
+    # per-seed difficulty, measured on the genomes that ran the full budget
+    seed_means = [statistics.mean(scores[i][seed] for i in racing) for seed in range(runs_per_net)]
+    overall = statistics.mean(seed_means)
+
+    for i, (_, genome) in enumerate(genomes):
+        n = len(scores[i])
+        genome.fitness = statistics.mean(scores[i]) - statistics.mean(seed_means[:n]) + overall
+
+    used = sum(len(s) for s in scores)
+    print("Racing ran {0} of {1} simulations ({2} saved)".format(used, runs_per_net * len(genomes),
+                                                                   runs_per_net * len(genomes) - used))
+
+    if profile_evaluator:
+        print_profile(pool)
+
+    return used
+
+
+def rank_correlation(x, y):
+    """
+    Spearman's rank correlation of two equally long lists, ties sharing their average rank.
+    """
+    def ranks(values):
+        order = sorted(range(len(values)), key=values.__getitem__)
+        result = [0.0 for _ in values]
+        start = 0
+        while start < len(order):
+            end = start
+            while end + 1 < len(order) and values[order[end + 1]] == values[order[start]]:
+                end += 1
+            for k in range(start, end + 1):
+                result[order[k]] = (start + end) / 2
+            start = end + 1
+        return result
+
+    rx, ry = ranks(x), ranks(y)
+    if len(set(rx)) < 2 or len(set(ry)) < 2:
+        return float('nan')
+    return statistics.correlation(rx, ry)
+
+
+def eval_genomes_screened(genomes, config, num=None, runs_per_net=25, fraction=screen_fraction, seeds=screen_seeds,
+                          seconds=screen_time, audit=screen_audit):
+    """
+    Evaluates a generation in two tiers. Every genome is first screened on a few seeds over a shorter run, and only
+    the best fraction of them go on to the full evaluation (runs_per_net seeds over the whole runtime), along with a
+    few of the rest picked at random to audit the screen.
+
+    The genomes that only ran the screen get their screening score put on the full scale by a least squares fit
+    across the genomes that ran both. When the fit is flat or inverted the screening scores are only shifted, which
+    keeps the order genomes were promoted in. Either way the screened-out genomes are then moved down together, if
+    need be, to lie strictly below the worst promoted genome, so screening never lifts a genome to or over one that
+    was promoted and their order is kept. The rank correlation between the two tiers, over the genomes that ran both,
+    shows whether the screen can be trusted.
+    """
+    pool = get_pool(num)
+    steps = int(seconds / t_step)
+
+    jobs = [(genome, seed) for _, genome in genomes for seed in range(seeds)]
+    fitnesses, _ = run_jobs(pool, jobs, config, runtime=steps)
+    screened = [statistics.mean(fitnesses[i * seeds: (i + 1) * seeds]) for i in range(len(genomes))]
+
+    order = sorted(range(len(genomes)), key=lambda i: screened[i], reverse=True)
+    promoted = order[:max(2, math.ceil(fraction * len(genomes)))]
+    audited = random.sample(order[len(promoted):], min(audit, len(order) - len(promoted)))
+    full_runs = promoted + audited
+
+    jobs = [(genomes[i][1], seed) for i in full_runs for seed in range(runs_per_net)]
+    fitnesses, _ = run_jobs(pool, jobs, config)
+    full = dict((i, statistics.mean(fitnesses[k * runs_per_net: (k + 1) * runs_per_net]))
+                for k, i in enumerate(full_runs))
+
+    x = [screened[i] for i in full_runs]
+    y = [full[i] for i in full_runs]
+    slope = 0.0
+    if len(set(x)) > 1:
+        slope, intercept = statistics.linear_regression(x, y)
+    if slope <= 0:  # the fit would reverse or erase the screen's order
+        slope, intercept = 1.0, statistics.mean(y) - statistics.mean(x)
+
+    estimates = dict((i, intercept + slope * screened[i]) for i in range(len(genomes)) if i not in full)
+    ceiling = math.nextafter(min(full[i] for i in promoted), -math.inf)
+    shift = max(0.0, max(estimates.values(), default=ceiling) - ceiling)
+
+    for i, (_, genome) in enumerate(genomes):
+        if i in full:
+            genome.fitness = full[i]
+        else:
+            genome.fitness = min(estimates[i] - shift, ceiling)  # min only guards against rounding in the shift
+
+    used = len(genomes) * seeds * steps + len(full_runs) * runs_per_net * total_steps
+    print("Screening promoted {0} of {1} genomes (and audited {2}), rank correlation between the tiers {3:.2f}, "
+          "{4:.0%} of the simulated time of a full evaluation".format(
+              len(promoted), len(genomes), len(audited), rank_correlation(x, y),
+              used / (len(genomes) * runs_per_net * total_steps)))
+
+    if profile_evaluator:
+        print_profile(pool)
+
+
+def get_fitness_function():
+    if use_screening:
+        return eval_genomes_screened
+    elif use_racing:
+        return eval_genomes_racing
+    return eval_genomes_parallel
+
+
+def save_results(config, winner, stats, suffix=''):
+    """
+    Saves the winner, its net drawing, the fitness and speciation plots and the best genomes of a run under neat/cbd.
+    stats is a StatisticsReporter or a telemetry.TelemetryLog.
+    """
+    with open('neat/cbd/winner-genome-9' + suffix, 'wb') as f:
+        pickle.dump(winner, f)
+
+    visualize.draw_net(config, winner, False, filename='neat/cbd/Digraph-9' + suffix)
+    visualize.plot_stats(stats, ylog=False, view=False, filename='neat/cbd/avg_fitness-9{0}.svg'.format(suffix))
+    visualize.plot_species(stats, view=False, filename='neat/cbd/speciation-9{0}.svg'.format(suffix))
+
+    with open('neat/cbd/best_genomes-8' + suffix, 'wb') as f:
+        pickle.dump(stats.best_unique_genomes(10), f)
+
+
+def get_telemetry_path(suffix=''):
+    return 'neat/cbd/telemetry-9{0}.jsonl'.format(suffix)
 
 
 def run(config_file):
+    global checkpointer
+
     # Load configuration.
     config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
                          neat.DefaultSpeciesSet, neat.DefaultStagnation,
                          config_file)
+    config.species_set_type = VectorSpeciesSet  # uses the DefaultSpeciesSet settings parsed above
 
     # ==== SIMULATION RUN ==== #
-    # Create the population, which is the top-level object for a NEAT run.
-    p = neat.Population(config)
+    # Create the population, which is the top-level object for a NEAT run, or carry on from the last checkpoint.
+    p = None
+    if checkpoint_dir is not None:
+        checkpointer = IncrementalCheckpointer(checkpoint_dir, full_interval=checkpoint_full_interval)
+        p = checkpointer.restore(config)
+    resumed = p is not None
+    if p is None:
+        p = neat.Population(config)
     # p = neat.Checkpointer.restore_checkpoint('neat/grid/checkpoints/neat-checkpoint-398')
 
-    # Add a stdout reporter to show progress in the terminal.
+    # Add a stdout reporter to show progress in the terminal, and log each generation to disk (see telemetry.py).
     p.add_reporter(neat.StdOutReporter(True))
-    stats = neat.StatisticsReporter()
-    p.add_reporter(stats)
+    telemetry = TelemetryReporter(get_telemetry_path(), append=resumed)
+    p.add_reporter(telemetry)
     # p.add_reporter(neat.Checkpointer(100, filename_prefix='neat/grid/checkpoints/neat-checkpoint-'))
+    if checkpointer is not None:
+        checkpointer.begin(p)
+        p.add_reporter(checkpointer)
 
     # Run for however many generations.
-    winner = p.run(eval_genomes_parallel, 100)
-
-    # Save the winner.
-    with open('neat/cbd/winner-genome-9', 'wb') as f:
-        pickle.dump(winner, f)
+    winner = p.run(get_fitness_function(), 100)
 
     # Display the winning genome.
     print('\nBest genome:\n{!s}'.format(winner))
 
-    visualize.draw_net(config, winner, False, filename='neat/cbd/Digraph-9')
-    visualize.plot_stats(stats, ylog=False, view=False, filename='neat/cbd/avg_fitness-9.svg')
-    # visualize.plot_species(stats, view=False, filename='neat/cbd/speciation-6.svg')
+    # Save the winner.
+    save_results(config, winner, telemetry.read())
 
-    with open('neat/cbd/best_genomes-8', 'wb') as f:
-        pickle.dump(stats.best_unique_genomes(10), f)
+
+def immigrate(p, migrants):
+    """
+    Puts migrants into the new generation of population p, in place of offspring picked at random (elites are kept),
+    and speciates it again.
+    """
+    offspring = [key for key, genome in p.population.items() if genome.fitness is None]
+    for key, migrant in zip(random.sample(offspring, min(len(offspring), len(migrants))), migrants):
+        del p.population[key]
+        migrant.key = next(p.reproduction.genome_indexer)  # every island numbers its genomes from 1
+        migrant.fitness = None  # scored again under this island's config
+        p.reproduction.ancestors[migrant.key] = tuple()
+        p.population[migrant.key] = migrant
+
+    p.species.speciate(p.config, p.population, p.generation)
+
+
+def run_island(index, config_file, seed, pool, inboxes, results, generations, interval=migration_interval,
+               size=migration_size):
+    """
+    Body of an island process. Evolves its own population, checkpointed in an island-N directory under
+    checkpoint_dir, and every interval generations sends copies of its size best genomes to the next island's inbox
+    and takes in whatever has arrived in its own, without waiting for any other island. Saves its results with an
+    -island-N suffix and puts (index, winner) on results, or (index, None) if it failed.
+    """
+    global checkpointer, shared_pool
+
+    shared_pool = pool
+    random.seed(seed)
+    name = 'island-{0}'.format(index + 1)
+    winner = None
+    try:
+        config = neat.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                             neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                             config_file)
+        config.species_set_type = VectorSpeciesSet  # uses the DefaultSpeciesSet settings parsed above
+
+        p = None
+        if checkpoint_dir is not None:
+            checkpointer = IncrementalCheckpointer(os.path.join(checkpoint_dir, name),
+                                                   full_interval=checkpoint_full_interval)
+            p = checkpointer.restore(config)
+        resumed = p is not None
+        if p is None:
+            p = neat.Population(config)
+
+        p.add_reporter(neat.StdOutReporter(False))
+        telemetry = TelemetryReporter(get_telemetry_path('-' + name), append=resumed)
+        p.add_reporter(telemetry)
+        if checkpointer is not None:
+            checkpointer.begin(p)
+            p.add_reporter(checkpointer)
+
+        fitness_function = get_fitness_function()
+        best = []
+
+        def evaluate(genomes, config):
+            fitness_function(genomes, config)
+            best[:] = sorted((genome for _, genome in genomes), key=lambda genome: genome.fitness, reverse=True)[:size]
+
+        while p.generation < generations:
+            start = p.generation
+            p.run(evaluate, min(interval, generations - start))
+            if p.generation < start + min(interval, generations - start) or p.generation >= generations:
+                break  # the fitness threshold was reached, or the run is over
+
+            inboxes[(index + 1) % len(inboxes)].put(best)
+            migrants = []
+            while True:
+                try:
+                    migrants.extend(inboxes[index].get_nowait())
+                except queue.Empty:
+                    break
+            if migrants:
+                immigrate(p, migrants)
+                print("{0}: took in {1} migrants at generation {2}".format(name, len(migrants), p.generation))
+
+        log = telemetry.read()
+        winner = p.best_genome
+        if winner is None and log.records:  # resumed at the last generation, so nothing ran this time
+            winner = log.best_unique_genomes(1)[0]
+        print('\n{0} best genome:\n{1!s}'.format(name, winner))
+        save_results(config, winner, log, suffix='-' + name)
+    finally:
+        if checkpointer is not None:
+            checkpointer.close()  # child processes skip atexit
+        for inbox in inboxes:
+            inbox.cancel_join_thread()  # migrants sent to an island that has finished are never read
+        pool.close()
+        results.put((index, winner))
+
+
+def run_islands(config_files, seeds=None, generations=100, num=None, interval=migration_interval,
+                size=migration_size):
+    """
+    Evolves a population per config file (the same file may be given more than once) in its own process, all sharing
+    this process's workers, with migration between them as in run_island. No island waits for another, so the workers
+    stay busy while any island is between generations. Saves each island's results as run_island does, and the best
+    winner of all under the names run uses.
+    """
+    if seeds is None:
+        seeds = range(len(config_files))
+
+    shared = workers.SharedPool(get_pool(num), len(config_files))
+    inboxes = [multiprocessing.Queue() for _ in config_files]
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_island, args=(k, config_file, seed, shared.views[k], inboxes,
+                                                                  results, generations, interval, size))
+                 for k, (config_file, seed) in enumerate(zip(config_files, seeds))]
+    for proc in processes:
+        proc.start()
+
+    winners = dict(results.get() for _ in processes)
+    for proc in processes:
+        proc.join()
+    shared.close()
+
+    failed = [k + 1 for k, winner in sorted(winners.items()) if winner is None]
+    if failed:
+        raise RuntimeError("Islands {0} failed".format(failed))
+
+    k, winner = max(winners.items(), key=lambda item: item[1].fitness)
+    print("\nBest genome from island {0} of {1}, fitness {2:.3f}".format(k + 1, len(processes), winner.fitness))
+    with open('neat/cbd/winner-genome-9', 'wb') as f:
+        pickle.dump(winner, f)
+
+    return winner
 
 
 if __name__ == '__main__':
@@ -111,4 +466,7 @@ if __name__ == '__main__':
     local_dir = os.path.dirname(__file__)
     config_path = os.path.join(local_dir, 'neat/config-ctrnn-cbd')
 
-    run(config_path)
+    if use_islands:
+        run_islands([config_path] * islands)
+    else:
+        run(config_path)
@@ -6,13 +6,17 @@ import numpy as np
 
 
 def plot_stats(statistics, ylog=False, view=False, filename='avg_fitness.svg'):
-    """ Plots the population's average and best fitness. """
+    """ Plots the population's average and best fitness, from a StatisticsReporter or a telemetry.TelemetryLog. """
     if plt is None:
         warnings.warn("This display is not available due to a missing optional dependency (matplotlib)")
         return
 
-    generation = range(len(statistics.most_fit_genomes))
-    best_fitness = [c.fitness for c in statistics.most_fit_genomes]
+    if hasattr(statistics, 'get_best_fitness'):  # a telemetry log only reads the best genomes from disk on demand
+        generation = statistics.get_generations()
+        best_fitness = statistics.get_best_fitness()
+    else:
+        generation = range(len(statistics.most_fit_genomes))
+        best_fitness = [c.fitness for c in statistics.most_fit_genomes]
     avg_fitness = np.array(statistics.get_fitness_mean())
     stdev_fitness = np.array(statistics.get_fitness_stdev())
 
@@ -86,7 +90,7 @@ def plot_spikes(spikes, view=False, filename=None, title=None):
 
 
 def plot_species(statistics, view=False, filename='speciation.svg'):
-    """ Visualizes speciation throughout evolution. """
+    """ Visualizes speciation throughout evolution, from a StatisticsReporter or a telemetry.TelemetryLog. """
     if plt is None:
         warnings.warn("This display is not available due to a missing optional dependency (matplotlib)")
         return
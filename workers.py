@@ -0,0 +1,333 @@
+from constants import sumoCmd, t_step, total_steps, batch_size, use_cache, worker_backend
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+import batch
+import cache
+import evaluation
+import profiling
+from compiled_ctrnn import CompiledCTRNN
+from multiprocessing import Process, Queue
+from multiprocessing.connection import wait
+
+
+def worker_loop(tasks, results, sumo_cmd, runtime, backend=worker_backend):
+    """
+    Body of a pool worker. Keeps one Evaluator (and so one sumo connection) alive for the lifetime of the pool and
+    evaluates (genome, seed) tasks until it receives None.
+    """
+    ev = evaluation.Evaluator.create(sumo_cmd=sumo_cmd, runtime=runtime, backend=backend)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        results.put(run_task(ev, sumo_cmd, task))
+
+
+def run_task(ev, sumo_cmd, task):
+    """
+    Runs one (index, genome, config, seed, cutoff, runtime) task on an Evaluator and returns its result as
+    (index, fitness, truncated, error, profile, metrics).
+    """
+    index, genome, config, seed, cutoff, runtime = task
+    cmd = sumo_cmd + ['--seed', str(seed)]
+    ev.runtime = runtime
+    try:
+        if genome is None:
+            fitness = ev.run_baseline(cmd=cmd)
+            truncated = False
+        else:
+            net = CompiledCTRNN.create(genome, config, t_step)
+            fitness = ev.get_net_fitness(net, cmd=cmd, cutoff=cutoff)
+            truncated = ev.truncated
+    except Exception:
+        return index, None, False, traceback.format_exc(), None, None
+
+    profile = ev.take_profile()
+    return index, fitness, truncated, None, None if profile is None else (os.getpid(), profile), ev.get_metrics()
+
+
+def batch_worker_loop(tasks, results, sumo_cmd, runtime, size):
+    """
+    Body of a pool worker that drives size simulations in lockstep. Takes whatever tasks are waiting, up to size at
+    a time, so the tail of a generation still runs on partial batches.
+    """
+    engine = batch.BatchEvaluator(size, sumo_cmd=sumo_cmd, runtime=runtime)
+
+    done = False
+    while not done:
+        jobs = [tasks.get()]
+        while len(jobs) < size and jobs[-1] is not None:
+            try:
+                jobs.append(tasks.get_nowait())
+            except queue.Empty:
+                break
+
+        if jobs[-1] is None:
+            jobs.pop()
+            done = True
+
+        if not jobs:
+            continue
+
+        try:
+            nets = [None if genome is None else CompiledCTRNN.create(genome, config, t_step)
+                    for _, genome, config, _, _, _ in jobs]
+            fitnesses = engine.get_fitnesses(nets, [sumo_cmd + ['--seed', str(seed)] for _, _, _, seed, _, _ in jobs],
+                                             cutoffs=[cutoff for _, _, _, _, cutoff, _ in jobs],
+                                             runtimes=[runtime for _, _, _, _, _, runtime in jobs])
+        except Exception:
+            error = traceback.format_exc()
+            for job in jobs:
+                results.put((job[0], None, False, error, None, None))
+            continue
+
+        for job, fitness, truncated, ev in zip(jobs, fitnesses, engine.truncated, engine.evaluators):
+            profile = ev.take_profile()
+            results.put((job[0], fitness, truncated, None, None if profile is None else (os.getpid(), profile),
+                         ev.get_metrics()))
+
+
+class EvaluationPool:
+    """
+    A long-lived pool of worker processes, each holding its own sumo connection. Jobs are pulled one (genome, seed)
+    pair at a time, so a slow simulation only holds up the worker running it. With a batch size above one each worker
+    runs that many simulations in lockstep instead, over labelled traci connections whatever the backend.
+    """
+
+    poll_interval = 1.0  # seconds evaluate waits for a result before checking that the workers are still alive
+
+    def __init__(self, num=None, sumo_cmd=sumoCmd, runtime=total_steps, size=batch_size, cached=use_cache,
+                 backend=worker_backend):
+        if num is None:
+            num = multiprocessing.cpu_count()
+
+        self.num = num
+        self.sumo_cmd = sumo_cmd
+        self.runtime = runtime
+        self.tasks = Queue()
+        self.results = Queue()
+        self.processes = []
+        self.profiles = {}  # worker pid -> Profile since the last take_profile, when profiling
+
+        for _ in range(num):
+            if size > 1:
+                proc = Process(target=batch_worker_loop, args=(self.tasks, self.results, sumo_cmd, runtime, size),
+                               daemon=True)
+            else:
+                proc = Process(target=worker_loop, args=(self.tasks, self.results, sumo_cmd, runtime, backend),
+                               daemon=True)
+            self.processes.append(proc)
+            proc.start()
+
+        self.cache = cache.EvaluationCache() if cached else None  # opened after forking, only the parent uses it
+
+    def evaluate(self, jobs, config=None, cutoff=None, on_result=None, runtime=None):
+        """
+        Runs a list of (genome, seed) jobs and returns their fitnesses in the same order. A genome of None runs the
+        baseline controller for that seed. Jobs already in the evaluation cache are not simulated again. Net runs
+        certain to score below cutoff are stopped early, self.truncated flags which ones were. self.metrics holds the
+        Evaluator.get_metrics of each simulated job (None for cached ones). on_result, if given, is called with
+        (index, fitness, truncated, metrics) as each simulated job finishes. runtime overrides the steps simulated
+        per run for these jobs only. If a worker dies (killed, or sumo crashing the process) the jobs it held cannot
+        be told apart from the others, so the pool is shut down and RuntimeError raised.
+        """
+        if runtime is None:
+            runtime = self.runtime
+
+        fitnesses = [0 for _ in range(len(jobs))]
+        self.truncated = [False for _ in range(len(jobs))]
+        self.metrics = [None for _ in range(len(jobs))]
+
+        keys = [cache.job_key(genome, seed, self.sumo_cmd, runtime) for genome, seed in jobs]
+        cached = self.cache.get_many(set(keys)) if self.cache is not None else {}
+
+        pending = 0
+        for i, (genome, seed) in enumerate(jobs):
+            if keys[i] in cached:
+                fitnesses[i] = cached[keys[i]]
+            else:
+                self.tasks.put((i, genome, config, seed, cutoff, runtime))
+                pending += 1
+
+        errors = []
+        while pending:  # drain every result so a failure does not leak into the next batch
+            try:
+                index, fitness, truncated, error, profile, metrics = self.results.get(timeout=self.poll_interval)
+            except queue.Empty:
+                dead = self.get_dead_workers()
+                if dead:
+                    self.terminate()
+                    raise RuntimeError("Worker {0} died while {1} jobs were unfinished, the pool has been shut "
+                                       "down".format(dead[0].pid, pending))
+                continue
+
+            pending -= 1
+            if error is not None:
+                errors.append((index, error))
+            if profile is not None:
+                self.profiles.setdefault(profile[0], profiling.Profile()).merge(profile[1])
+            if on_result is not None and error is None:
+                on_result(index, fitness, truncated, metrics)
+            fitnesses[index] = fitness
+            self.truncated[index] = truncated
+            self.metrics[index] = metrics
+
+        if self.cache is not None:  # truncated runs only hold a bound, so they are not cached
+            self.cache.put_many(dict((keys[i], fitnesses[i]) for i in range(len(jobs))
+                                     if keys[i] not in cached and fitnesses[i] is not None and not self.truncated[i]))
+
+        if errors:
+            raise RuntimeError("Evaluation of job {0} failed in a worker:\n{1}".format(*errors[0]))
+
+        return fitnesses
+
+    def take_profile(self):
+        """
+        Returns the merged evaluator profile of every job run since the last call, along with a line per worker, and
+        starts over. The profile is empty unless profile_evaluator is set.
+        """
+        profile, workers = profiling.merge_worker_profiles(self.profiles)
+        self.profiles = {}
+        return profile, workers
+
+    def get_dead_workers(self):
+        """
+        Returns the workers that have exited. Their sentinels are checked rather than Process.is_alive, which only
+        works in the process that started them, so a view of the pool in a forked process can check them as well.
+        """
+        ended = set(wait([proc.sentinel for proc in self.processes], timeout=0))
+        return [proc for proc in self.processes if proc.sentinel in ended]
+
+    def terminate(self):
+        """
+        Kills the workers along with whatever they are running and closes the pool.
+        """
+        for proc in self.processes:
+            proc.kill()
+
+        self.close()
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+
+        for proc in self.processes:
+            proc.join()
+
+        self.processes = []
+
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+class PoolView(EvaluationPool):
+    """
+    One process's share of a pool that lives in another process (see SharedPool): evaluate runs its jobs on that
+    pool's workers and gets back only its own results. The view opens its own evaluation cache where it is used.
+    processes are the pool's workers, so that a view stops waiting on one that died (and shuts the pool down).
+    """
+
+    def __init__(self, channel, requests, results, num, sumo_cmd, runtime, processes=(), cached=use_cache):
+        self.channel = channel
+        self.requests = requests
+        self.results = results
+        self.num = num
+        self.sumo_cmd = sumo_cmd
+        self.runtime = runtime
+        self.cached = cached
+        self.tasks = self  # evaluate puts its tasks here, see put
+        self.processes = list(processes)
+        self.profiles = {}
+        self.cache = None
+
+    def put(self, task):
+        self.requests.put(((self.channel, task[0]),) + task[1:])
+
+    def evaluate(self, jobs, config=None, cutoff=None, on_result=None, runtime=None):
+        if self.cached and self.cache is None:
+            self.cache = cache.EvaluationCache()
+        return super().evaluate(jobs, config, cutoff=cutoff, on_result=on_result, runtime=runtime)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+class SharedPool:
+    """
+    Lets other processes run jobs on a pool (the local one or a coordinator) at the same time, each through its own
+    PoolView. Two threads in the pool's process pass the jobs of every view on to the pool and send each result back
+    to the view it came from. The pool itself should not be used until the SharedPool is closed.
+    """
+
+    def __init__(self, pool, channels):
+        self.pool = pool
+        self.requests = Queue()
+        self.views = [PoolView(k, self.requests, Queue(), pool.num, pool.sumo_cmd, pool.runtime, pool.processes)
+                      for k in range(channels)]
+
+        self.threads = [threading.Thread(target=self.relay_loop, daemon=True),
+                        threading.Thread(target=self.route_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def relay_loop(self):
+        while True:
+            task = self.requests.get()
+            if task is None:
+                break
+            self.pool.tasks.put(task)
+
+    def route_loop(self):
+        while True:
+            result = self.pool.results.get()
+            if result is None:
+                break
+            channel, index = result[0]
+            self.views[channel].results.put((index,) + result[1:])
+
+    def close(self):
+        self.requests.put(None)
+        self.pool.results.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+_pool = None
+
+
+def get_pool(num=None):
+    """
+    Returns the shared pool for this process, starting it on first use so later generations reuse the same workers.
+    A pool that lost a worker is replaced.
+    """
+    global _pool
+
+    if num is None:
+        num = multiprocessing.cpu_count()
+
+    if _pool is not None and (_pool.num != num or not _pool.processes or _pool.get_dead_workers()):
+        _pool.close()
+        _pool = None
+
+    if _pool is None:
+        _pool = EvaluationPool(num=num)
+
+    return _pool
+
+
+@atexit.register
+def close_pool():
+    global _pool
+
+    if _pool is not None:
+        _pool.close()
+        _pool = None